@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+法条引用直查
+"劳动法第六十六条" 这类查询本质上是条文引用，向量检索往往不能把对应法条排在第一位。
+入库时为法条建立 (法律名, 条号) → node_id 的哈希索引，检索时先识别查询中的条文引用，
+能完整解析的直接按索引取回法条，不计算查询向量；其余查询照常走向量检索。
+"""
+
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ARTICLE_INDEX_DIR = "kb_articles"
+# 与 test/get_data.py 切分法条时使用的条号写法一致，另外兼容 "千"、"两" 与阿拉伯数字
+ARTICLE_PATTERN = re.compile(r"第([一二两三四五六七八九十零〇百千\d]+)条")
+# 法律全称的通用前缀，查询中通常省略
+LAW_NAME_PREFIX = "中华人民共和国"
+# 查询中提到某部法律（不论是否在索引中）的粗略特征：以 "法"、"法典"、"条例"、"细则" 结尾的词
+LAW_MENTION_PATTERN = re.compile(r"[\u4e00-\u9fff](?:法典|法|条例|细则)")
+
+_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_UNITS = {"十": 10, "百": 100, "千": 1000}
+
+
+def article_index_path(chroma_path, collection_name: str) -> Path:
+    return Path(chroma_path) / ARTICLE_INDEX_DIR / f"{collection_name}.json"
+
+
+def parse_article_number(text: str) -> Optional[int]:
+    """条号转为整数："六十六" → 66，"一百零六" → 106，"十二" → 12，"66" → 66；无法解析时返回 None"""
+    if text.isdigit():
+        return int(text)
+    total, digit = 0, None
+    for ch in text:
+        if ch in _DIGITS:
+            digit = _DIGITS[ch]
+        elif ch in _UNITS:
+            # "十二" 省略了开头的 "一"
+            total += (1 if digit is None else digit) * _UNITS[ch]
+            digit = None
+        else:
+            return None
+    total += digit or 0
+    return total or None
+
+
+def law_aliases(law_name: str) -> List[str]:
+    """法律在查询中可能的写法：全称与去掉 "中华人民共和国" 前缀的简称"""
+    aliases = [law_name]
+    if law_name.startswith(LAW_NAME_PREFIX) and len(law_name) > len(LAW_NAME_PREFIX):
+        aliases.append(law_name[len(LAW_NAME_PREFIX):])
+    return aliases
+
+
+class ArticleIndex:
+    """(法律名, 条号) → node_id 列表的哈希索引，附带写入时的集合版本戳与集合 id"""
+
+    def __init__(self, version: int = 0, collection_id: str = ""):
+        self.entries: Dict[Tuple[str, int], List[str]] = {}
+        self.aliases: Dict[str, str] = {}
+        self.version = version
+        self.collection_id = collection_id
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def laws(self) -> List[str]:
+        return sorted({law_name for law_name, _ in self.entries})
+
+    def add(self, node_id: str, metadata: dict) -> bool:
+        """登记一个法条节点（元数据需含 law_name 与 article），条号无法解析时忽略"""
+        law_name = metadata.get("law_name")
+        match = ARTICLE_PATTERN.fullmatch(metadata.get("article") or "")
+        number = parse_article_number(match.group(1)) if match else None
+        if not law_name or number is None:
+            return False
+        node_ids = self.entries.setdefault((law_name, number), [])
+        if node_id not in node_ids:
+            node_ids.append(node_id)
+        for alias in law_aliases(law_name):
+            self.aliases.setdefault(alias, law_name)
+        return True
+
+    @classmethod
+    def from_records(cls, records: Iterable[Tuple[str, dict]], **kwargs) -> "ArticleIndex":
+        index = cls(**kwargs)
+        for node_id, metadata in records:
+            index.add(node_id, metadata or {})
+        return index
+
+    def _law_in(self, text: str) -> Tuple[Optional[str], int]:
+        """text 中最靠后提到的索引内法律（同一位置取最长的写法）及其结束位置，没有时返回 (None, -1)"""
+        best, best_key = None, None
+        for alias, law_name in self.aliases.items():
+            position = text.rfind(alias)
+            if position >= 0 and (best_key is None or (position + len(alias), len(alias)) > best_key):
+                best, best_key = law_name, (position + len(alias), len(alias))
+        return best, best_key[0] if best_key is not None else -1
+
+    def resolve(self, query: str) -> Optional[List[str]]:
+        """解析查询中的全部条文引用，全部能在索引中找到时按引用顺序返回 node_id，否则返回 None
+
+        引用前未写法律名时沿用上一个引用的法律（"劳动法第三十六条和第四十一条"）；
+        集合中只有一部法律时可以省略法律名。引用前提到的是索引中没有的法律（"刑法第十条"）时返回 None。
+        """
+        if not self.entries:
+            return None
+        matches = list(ARTICLE_PATTERN.finditer(query))
+        if not matches:
+            return None
+        laws = self.laws
+        current = laws[0] if len(laws) == 1 else None
+        node_ids, previous_end = [], 0
+        for match in matches:
+            segment = query[previous_end:match.start()]
+            law_name, law_end = self._law_in(segment)
+            mention_end = max((m.end() for m in LAW_MENTION_PATTERN.finditer(segment)), default=-1)
+            if mention_end > law_end:
+                return None
+            current = law_name or current
+            number = parse_article_number(match.group(1))
+            found = self.entries.get((current, number)) if current is not None and number is not None else None
+            if not found:
+                return None
+            node_ids.extend(node_id for node_id in found if node_id not in node_ids)
+            previous_end = match.end()
+        return node_ids
+
+    def save(self, path):
+        """写入 JSON；先写临时文件再原子替换"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": self.version,
+            "collection_id": self.collection_id,
+            "articles": [[law_name, number, node_ids] for (law_name, number), node_ids in self.entries.items()],
+        }
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        logger.info(f"条文索引已写入: {len(self)} 条 -> {path}")
+
+    @classmethod
+    def load(cls, path) -> Optional["ArticleIndex"]:
+        """读取 JSON，文件不存在或损坏时返回 None"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            index = cls(version=data["version"], collection_id=data["collection_id"])
+            for law_name, number, node_ids in data["articles"]:
+                index.entries[(law_name, number)] = node_ids
+                for alias in law_aliases(law_name):
+                    index.aliases.setdefault(alias, law_name)
+            return index
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"读取条文索引失败 {path}: {e}")
+            return None
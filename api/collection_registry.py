@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+集合句柄注册表
+按 collection_name 缓存 Chroma 集合句柄（小集合还有精确检索用的内存向量矩阵及其他惰性构建的索引），
+检索直接查询 Chroma 或内存矩阵，避免每次 /retrieve 都重新打开集合、载入向量。
+配置了快照目录且存在与当前版本戳一致的快照时，精确检索直接使用 mmap 映射的快照（见 vector_snapshot）。
+句柄同时提供集合的自适应默认阈值（见 score_profile）。阈值只是检索结果的后过滤，不减少检索本身的计算量：
+Chroma（HNSW）仍取回 n_results 条候选；精确检索引擎仍对全部行计算距离，阈值只缩小 top-k 选取与需要组装的记录数。
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from itertools import takewhile
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SearchHit(NamedTuple):
+    """直接查询 Chroma 得到的一条候选"""
+    node_id: str
+    content: str
+    metadata: dict
+    score: float
+
+
+# 问答集合（ingestion 的 qa 内容类型）中问题节点的 content_type，命中后换成其关联的回答
+QA_QUESTION = "qa_question"
+# 问答集合按问题、回答双路索引，同一回答可能被命中两次，查询时多取一倍候选再去重
+QA_OVERFETCH = 2
+# 混合检索中稀疏、稠密两路各取的候选数：top_k 的若干倍，且不少于下限
+HYBRID_CANDIDATE_FACTOR = 4
+HYBRID_MIN_CANDIDATES = 20
+
+
+def distance_to_score(distance: float) -> float:
+    """与 ChromaVectorStore 一致的距离→相似度换算，保证阈值在各检索路径下含义相同"""
+    return math.exp(-distance)
+
+
+def score_to_distance(score: float) -> float:
+    """distance_to_score 的逆换算，用于把分数阈值转成检索阶段的距离上限"""
+    return math.inf if score <= 0 else -math.log(score)
+
+
+class CollectionHandle:
+    """单个集合的常驻句柄"""
+
+    def __init__(self, name, chroma_collection, version: int = 0, search_engine: str = "auto",
+                 exact_max_vectors: int = 10000, exact_dtype: str = "float32", snapshot_dir: Optional[str] = None,
+                 chroma_path: Optional[str] = None, default_threshold: float = 0.65, auto_threshold: bool = True):
+        self.name = name
+        self.version = version
+        self.collection = chroma_collection
+        self.collection_id = str(chroma_collection.id)
+        self.space = (chroma_collection.metadata or {}).get("hnsw:space", "l2")
+        self.snapshot_dir = snapshot_dir
+        self.chroma_path = chroma_path
+        self.is_qa = (chroma_collection.metadata or {}).get("kb_content_type") == "qa"
+        self.default_threshold = default_threshold
+        self.auto_threshold = auto_threshold
+        # 检索引擎：小集合（或强制 exact 时）把向量载入内存矩阵做精确检索，否则走 Chroma 的 HNSW
+        self.engine = "hnsw"
+        self.exact_index = None
+        self.snapshot = None
+        snapshot = self._open_snapshot(snapshot_dir) if search_engine != "hnsw" and snapshot_dir else None
+        count = len(snapshot) if snapshot is not None else None
+        if search_engine == "exact" or (search_engine == "auto" and (count if count is not None else chroma_collection.count()) <= exact_max_vectors):
+            from exact_search import ExactIndex
+            if snapshot is not None:
+                self.exact_index = ExactIndex.from_snapshot(snapshot)
+                self.snapshot = snapshot.path
+            else:
+                self.exact_index = ExactIndex.from_collection(chroma_collection, dtype=exact_dtype)
+            self.engine = "exact"
+        self._sparse_index = None
+        self._metadata_index = None
+        self._article_index = None
+        self._score_profile = None
+        self._lock = threading.Lock()
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.last_validated = time.monotonic()
+
+    def _open_snapshot(self, snapshot_dir: str):
+        """打开与当前集合 id、版本戳一致的快照，不存在或已过期时返回 None（回退为从 Chroma 载入）"""
+        from vector_snapshot import VectorSnapshot, read_header, snapshot_path
+
+        path = snapshot_path(snapshot_dir, self.name)
+        header = read_header(path)
+        if header is None:
+            return None
+        if header.get("collection_id") != self.collection_id or header["version"] != self.version:
+            logger.info(f"集合 '{self.name}' 的快照已过期 (快照版本 {header['version']}, 当前版本 {self.version})，改为从 Chroma 载入")
+            return None
+        return VectorSnapshot(path)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int, where: Optional[dict] = None,
+              min_score: Optional[float] = None) -> List[List[SearchHit]]:
+        """一次向量化查询多个查询向量，按输入顺序返回各自的候选列表
+
+        给出 min_score 时低于该分数的候选不返回（后过滤，检索本身的计算量不变）。
+        """
+        n_candidates = n_results * QA_OVERFETCH if self.is_qa else n_results
+        return self._resolve(self._search(query_embeddings, n_candidates, where, min_score), n_results)
+
+    def hybrid_query(self, query: str, query_embedding: List[float], n_results: int,
+                     prefilter: bool = False, where: Optional[dict] = None,
+                     min_score: Optional[float] = None) -> List[SearchHit]:
+        """稀疏（BM25）与稠密两路排名做倒数排名融合
+
+        返回的 score 仍是稠密相似度（只出现在稀疏候选中的文档单独补算），阈值含义与纯稠密检索一致，
+        融合只决定哪些文档进入 top_k 及其顺序。prefilter 为 True 且稀疏候选足够时，
+        稠密打分只在稀疏候选上进行，不再扫描整个集合。where 同时作用于两路检索。
+        给出 min_score 时，融合结果中稠密分数低于它的文档不占用 top_k 名额。
+        """
+        from sparse_index import reciprocal_rank_fusion
+
+        n_fetch = n_results * QA_OVERFETCH if self.is_qa else n_results
+        n_candidates = max(n_fetch * HYBRID_CANDIDATE_FACTOR, HYBRID_MIN_CANDIDATES)
+        sparse_index = self.sparse_index()
+        allowed = sparse_index.mask_for(self._filter_ids(where)) if where is not None else None
+        sparse_ids = [node_id for node_id, _ in sparse_index.search(query, n_candidates, allowed)]
+        if prefilter and len(sparse_ids) >= n_fetch:
+            dense = self._score_ids(query_embedding, sparse_ids)
+            scored = {hit.node_id: hit for hit in dense}
+        else:
+            dense = self._search([query_embedding], n_candidates, where)[0]
+            scored = {hit.node_id: hit for hit in dense}
+            missing = [node_id for node_id in sparse_ids if node_id not in scored]
+            scored.update((hit.node_id, hit) for hit in self._score_ids(query_embedding, missing))
+
+        fused = reciprocal_rank_fusion([[hit.node_id for hit in dense], sparse_ids])
+        hits = [
+            scored[node_id] for node_id, _ in fused
+            if node_id in scored and (min_score is None or scored[node_id].score >= min_score)
+        ][:n_fetch]
+        return self._resolve([hits], n_results)[0]
+
+    def lookup_articles(self, query: str, n_results: int) -> Optional[List[SearchHit]]:
+        """查询是 "劳动法第六十六条" 这类条文引用且全部能在条文索引中找到时直接返回对应法条（分数记为 1.0），
+        否则返回 None，由调用方照常走向量检索"""
+        node_ids = self.article_index().resolve(query)
+        if not node_ids:
+            return None
+        node_ids = node_ids[:n_results]
+        if self.exact_index is not None:
+            hits = []
+            for row in self.exact_index.rows_for(node_ids):
+                node_id, document, metadata = self.exact_index.records[row]
+                hits.append(SearchHit(node_id, document, metadata, 1.0))
+            return hits or None
+        fetched = self.collection.get(ids=node_ids, include=["documents", "metadatas"])
+        found = {
+            node_id: SearchHit(node_id, document or "", metadata or {}, 1.0)
+            for node_id, document, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])
+        }
+        return [found[node_id] for node_id in node_ids if node_id in found] or None
+
+    def article_index(self):
+        """(法律名, 条号) → node_id 索引：优先读取入库时写入且版本一致的索引文件，否则从法条元数据构建"""
+        with self._lock:
+            if self._article_index is None:
+                self._article_index = self._load_article_index()
+            return self._article_index
+
+    def _load_article_index(self):
+        from article_lookup import ArticleIndex, article_index_path
+
+        if self.chroma_path:
+            index = ArticleIndex.load(article_index_path(self.chroma_path, self.name))
+            if index is not None and index.version == self.version and index.collection_id == self.collection_id:
+                return index
+        if self.exact_index is not None:
+            records = ((self.exact_index.records[i][0], self.exact_index.records[i][2]) for i in range(len(self.exact_index)))
+        else:
+            fetched = self.collection.get(where={"content_type": "legal_article"}, include=["metadatas"])
+            records = zip(fetched["ids"], fetched["metadatas"])
+        index = ArticleIndex.from_records(
+            (node_id, metadata) for node_id, metadata in records
+            if (metadata or {}).get("content_type") == "legal_article"
+        )
+        logger.info(f"集合 '{self.name}' 条文索引已构建: {len(index)} 条")
+        return index
+
+    def similarity_threshold(self) -> float:
+        """未指定阈值的请求使用的默认阈值：集合分数画像给出的自适应阈值，画像不可用时为全局默认值"""
+        if self.auto_threshold:
+            threshold = self.score_profile().threshold
+            if threshold is not None:
+                return threshold
+        return self.default_threshold
+
+    def score_profile(self):
+        """集合的分数分布画像：优先读取入库时写入且版本一致的画像文件，否则抽样计算"""
+        with self._lock:
+            if self._score_profile is None:
+                self._score_profile = self._load_score_profile()
+            return self._score_profile
+
+    def _load_score_profile(self):
+        from score_profile import ScoreProfile, profile_path
+
+        if self.chroma_path:
+            profile = ScoreProfile.load(profile_path(self.chroma_path, self.name))
+            if profile is not None and profile.version == self.version and profile.collection_id == self.collection_id:
+                return profile
+        if self.exact_index is not None:
+            profile = ScoreProfile.from_exact_index(self.exact_index, version=self.version, collection_id=self.collection_id)
+        else:
+            profile = ScoreProfile.from_collection(self.collection, version=self.version)
+        logger.info(f"集合 '{self.name}' 分数画像已计算: 阈值 {profile.threshold}, 样本 {profile.samples}")
+        return profile
+
+    def sparse_index(self):
+        """集合的 BM25 索引：优先读取入库时写入快照目录且版本一致的索引，否则从已载入的记录或 Chroma 构建"""
+        with self._lock:
+            if self._sparse_index is None:
+                self._sparse_index = self._load_sparse_index()
+            return self._sparse_index
+
+    def metadata_index(self):
+        """精确检索引擎的内存元数据位图索引，首次带过滤条件检索时构建"""
+        with self._lock:
+            if self._metadata_index is None:
+                from metadata_filter import MetadataIndex
+                self._metadata_index = MetadataIndex(self.exact_index.records)
+            return self._metadata_index
+
+    def _filter_ids(self, where: dict) -> List[str]:
+        """满足过滤条件的全部节点 id：精确检索引擎查内存位图，否则下推给 Chroma 的元数据查询"""
+        if self.exact_index is not None:
+            metadata_index = self.metadata_index()
+            return [metadata_index.ids[i] for i in metadata_index.rows(where)]
+        return self.collection.get(where=where, include=[])["ids"]
+
+    def _load_sparse_index(self):
+        from sparse_index import SparseIndex, sparse_index_path
+
+        if self.snapshot_dir:
+            index = SparseIndex.load(sparse_index_path(self.snapshot_dir, self.name))
+            if index is not None and index.version == self.version and index.collection_id == self.collection_id:
+                logger.info(f"集合 '{self.name}' 使用已导出的稀疏索引 ({len(index)} 个文档)")
+                return index
+        started = time.perf_counter()
+        if self.exact_index is not None:
+            index = SparseIndex.from_records(self.exact_index.records, version=self.version, collection_id=self.collection_id)
+        else:
+            index = SparseIndex.from_collection(self.collection, version=self.version)
+        logger.info(
+            f"集合 '{self.name}' 稀疏索引已构建: {len(index)} 个文档, {len(index.vocab)} 个词, "
+            f"耗时 {round((time.perf_counter() - started) * 1000, 1)} ms"
+        )
+        return index
+
+    def _score_ids(self, query_embedding: List[float], node_ids: List[str]) -> List[SearchHit]:
+        """只对给定节点计算稠密分数，按分数降序返回"""
+        if not node_ids:
+            return []
+        from exact_search import ExactIndex
+
+        if self.exact_index is not None:
+            rows = self.exact_index.rows_for(node_ids)
+            return self.exact_index.search([query_embedding], len(rows), rows=rows)[0]
+        fetched = self.collection.get(ids=node_ids, include=["embeddings", "documents", "metadatas"])
+        index = ExactIndex.from_lists(
+            fetched["ids"],
+            [d or "" for d in fetched["documents"]],
+            [m or {} for m in fetched["metadatas"]],
+            fetched["embeddings"],
+            space=self.space
+        )
+        return index.search([query_embedding], len(index))[0]
+
+    def _search(self, query_embeddings: List[List[float]], n_results: int, where: Optional[dict] = None,
+                min_score: Optional[float] = None) -> List[List[SearchHit]]:
+        if self.exact_index is None:
+            hits = self._query_chroma(query_embeddings, n_results, where)
+            if min_score is None:
+                return hits
+            # 后过滤：Chroma 已取回全部 n_results 条候选，按距离升序截到第一个低于阈值的候选
+            # （问答集合因此少取被淘汰问题的回答）
+            return [list(takewhile(lambda hit: hit.score >= min_score, query_hits)) for query_hits in hits]
+        # 精确检索引擎按元数据位图只对满足条件的行计算距离
+        rows = self.metadata_index().rows(where) if where is not None else None
+        max_distance = score_to_distance(min_score) if min_score is not None else None
+        return self.exact_index.search(query_embeddings, n_results, rows=rows, max_distance=max_distance)
+
+    def _resolve(self, hits: List[List[SearchHit]], n_results: int) -> List[List[SearchHit]]:
+        if self.is_qa or any(hit.metadata.get("content_type") == QA_QUESTION for query_hits in hits for hit in query_hits):
+            return self._resolve_questions(hits, n_results)
+        return [query_hits[:n_results] for query_hits in hits]
+
+    def _query_chroma(self, query_embeddings: List[List[float]], n_results: int, where: Optional[dict]) -> List[List[SearchHit]]:
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+        hits = []
+        for ids, documents, metadatas, distances in zip(
+            results["ids"], results["documents"], results["metadatas"], results["distances"]
+        ):
+            hits.append([
+                SearchHit(node_id, document or "", metadata or {}, distance_to_score(distance))
+                for node_id, document, metadata, distance in zip(ids, documents, metadatas, distances)
+            ])
+        return hits
+
+    def _resolve_questions(self, hits_per_query: List[List[SearchHit]], n_results: int) -> List[List[SearchHit]]:
+        """把命中的问题节点换成其关联的回答（保留问题的匹配分数），同一回答只保留分数最高的一次"""
+        answer_ids = {
+            hit.metadata.get("answer_id")
+            for hits in hits_per_query for hit in hits
+            if hit.metadata.get("content_type") == QA_QUESTION
+        }
+        answer_ids.discard(None)
+        answers = {}
+        if answer_ids:
+            fetched = self.collection.get(ids=list(answer_ids), include=["documents", "metadatas"])
+            answers = {
+                node_id: (document or "", metadata or {})
+                for node_id, document, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])
+            }
+
+        resolved = []
+        for hits in hits_per_query:
+            merged = []
+            seen = set()
+            # Chroma 按距离升序返回，先出现的即分数最高的
+            for hit in hits:
+                node_id, content, metadata = hit.node_id, hit.content, hit.metadata
+                if metadata.get("content_type") == QA_QUESTION:
+                    answer = answers.get(metadata.get("answer_id"))
+                    if answer is None:
+                        continue
+                    node_id = metadata["answer_id"]
+                    content, answer_metadata = answer
+                    metadata = dict(answer_metadata, matched_question=hit.content)
+                if node_id in seen:
+                    continue
+                seen.add(node_id)
+                merged.append(SearchHit(node_id, content, metadata, hit.score))
+            resolved.append(merged[:n_results])
+        return resolved
+
+
+class CollectionRegistry:
+    """带 LRU 淘汰的集合句柄缓存
+
+    命中时每隔 revalidate_seconds 向 Chroma 确认一次集合仍然存在且 id 未变，
+    集合被删除或被删除后重建（重新入库）时自动失效对应条目；
+    提供 version_of 时，集合版本戳变化（原地重新入库）也会使条目失效。
+    """
+
+    def __init__(self, client, max_size: int = 16, revalidate_seconds: float = 5.0, version_of=None,
+                 search_engine: str = "auto", exact_max_vectors: int = 10000, exact_dtype: str = "float32",
+                 snapshot_dir: Optional[str] = None, chroma_path: Optional[str] = None,
+                 default_threshold: float = 0.65, auto_threshold: bool = True):
+        self.client = client
+        self.version_of = version_of
+        self.search_engine = search_engine
+        self.exact_max_vectors = exact_max_vectors
+        self.exact_dtype = exact_dtype
+        self.snapshot_dir = snapshot_dir
+        self.chroma_path = chroma_path
+        self.default_threshold = default_threshold
+        self.auto_threshold = auto_threshold
+        self.max_size = max_size
+        self.revalidate_seconds = revalidate_seconds
+        self._entries: "OrderedDict[str, CollectionHandle]" = OrderedDict()
+        # 曾成功打开过的集合名（被淘汰、失效后仍保留），数量受 Chroma 中实际存在的集合限制
+        self._known = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def acquire(self, name: str) -> CollectionHandle:
+        """获取集合句柄，集合不存在时抛出 chroma 的原始异常"""
+        with self._lock:
+            handle = self._entries.get(name)
+            if handle is not None:
+                self._entries.move_to_end(name)
+
+        if handle is not None and self._is_fresh(handle):
+            with self._lock:
+                self.hits += 1
+            handle.last_used = time.time()
+            return handle
+
+        with self._lock:
+            self.misses += 1
+
+        # 构建过程不持锁，避免慢集合阻塞其它集合的命中
+        version = self.version_of(name) if self.version_of is not None else 0
+        chroma_collection = self.client.get_collection(name=name)
+        handle = CollectionHandle(
+            name, chroma_collection, version,
+            search_engine=self.search_engine,
+            exact_max_vectors=self.exact_max_vectors,
+            exact_dtype=self.exact_dtype,
+            snapshot_dir=self.snapshot_dir,
+            chroma_path=self.chroma_path,
+            default_threshold=self.default_threshold,
+            auto_threshold=self.auto_threshold
+        )
+        if handle.auto_threshold:
+            # 预先载入分数画像，请求中取默认阈值时不再涉及 I/O
+            handle.score_profile()
+        source = f", 快照: {handle.snapshot}" if handle.snapshot else ""
+        logger.info(f"集合句柄已缓存: {name} (id={handle.collection_id}, 检索引擎: {handle.engine}{source})")
+
+        with self._lock:
+            self._entries[name] = handle
+            self._known.add(name)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                logger.info(f"集合句柄被 LRU 淘汰: {evicted}")
+        return handle
+
+    def is_known(self, name: str) -> bool:
+        """name 是否为曾成功打开过的集合"""
+        with self._lock:
+            return name in self._known
+
+    def _is_fresh(self, handle: CollectionHandle) -> bool:
+        """确认集合版本戳未变，并周期性确认集合未被删除或重建"""
+        if self.version_of is not None and self.version_of(handle.name) != handle.version:
+            self.invalidate(handle.name)
+            return False
+        now = time.monotonic()
+        if now - handle.last_validated < self.revalidate_seconds:
+            return True
+        try:
+            current = self.client.get_collection(name=handle.name)
+        except Exception:
+            self.invalidate(handle.name)
+            return False
+        if str(current.id) != handle.collection_id:
+            self.invalidate(handle.name)
+            return False
+        handle.last_validated = now
+        return True
+
+    def invalidate(self, name: Optional[str] = None) -> int:
+        """失效指定集合的句柄，name 为空时清空全部，返回失效条目数"""
+        with self._lock:
+            if name is None:
+                count = len(self._entries)
+                self._entries.clear()
+            else:
+                count = 1 if self._entries.pop(name, None) is not None else 0
+            self.invalidations += count
+        if count:
+            logger.info(f"集合句柄已失效: {name or '全部'}")
+        return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "collections": list(self._entries.keys()),
+                "engines": {name: handle.engine for name, handle in self._entries.items()},
+                "snapshots": [name for name, handle in self._entries.items() if handle.snapshot],
+                "sparse_indexes": [name for name, handle in self._entries.items() if handle._sparse_index is not None],
+                "metadata_indexes": [name for name, handle in self._entries.items() if handle._metadata_index is not None],
+                "score_thresholds": {
+                    name: handle._score_profile.threshold
+                    for name, handle in self._entries.items() if handle._score_profile is not None
+                },
+            }
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可插拔的 embedding 后端
+- torch: llama_index 的 HuggingFaceEmbedding（sentence-transformers + PyTorch）
+- onnx-int8: 导出为 ONNX 并做动态 int8 量化，用按线程数调优的 onnxruntime 会话在 CPU 上推理
+
+两种后端都是 llama_index 的 BaseEmbedding，可直接赋给 Settings.embed_model，API 与入库脚本共用。
+导出：python embedding_backends.py export <模型路径> <输出目录>
+"""
+
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKEND_TORCH = "torch"
+BACKEND_ONNX_INT8 = "onnx-int8"
+BACKENDS = (BACKEND_TORCH, BACKEND_ONNX_INT8)
+
+# 与 sentence-transformers 中该模型的 max_seq_length 保持一致
+MAX_SEQ_LENGTH = 128
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+EXPORT_INFO_FILE = "export_info.json"
+
+
+def export_onnx_int8(model_path: str, output_dir: str) -> Path:
+    """把 transformer 主干导出为 ONNX，并做动态 int8 量化，返回量化模型路径
+
+    池化（mean pooling）与归一化在推理时用 numpy 完成，与 sentence-transformers 的计算方式一致。
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    logger.info(f"正在导出 ONNX 模型: {model_path} -> {output}")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModel.from_pretrained(model_path).eval()
+    dummy = tokenizer(["劳动者享有平等就业的权利"], return_tensors="pt")
+    # forward 的位置参数顺序为 input_ids, attention_mask, token_type_ids
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    fp32_path = output / ONNX_FP32_FILE
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[name] for name in input_names),
+            str(fp32_path),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    int8_path = output / ONNX_INT8_FILE
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(str(output))
+    with open(output / EXPORT_INFO_FILE, "w", encoding="utf-8") as f:
+        json.dump({"source_model": model_path, "input_names": input_names, "max_seq_length": MAX_SEQ_LENGTH}, f, ensure_ascii=False, indent=2)
+
+    logger.info(f"ONNX int8 模型导出完成: {int8_path}")
+    return int8_path
+
+
+def _build_onnx_embedding_class():
+    """延迟定义 OnnxEmbedding，避免导入本模块时就加载 llama_index"""
+    import numpy as np
+    from llama_index.core.embeddings import BaseEmbedding
+    from llama_index.core.bridge.pydantic import PrivateAttr
+
+    class OnnxEmbedding(BaseEmbedding):
+        """onnxruntime 推理的 int8 量化 sentence embedding"""
+
+        _session = PrivateAttr()
+        _tokenizer = PrivateAttr()
+        _input_names = PrivateAttr()
+
+        def __init__(self, model_dir: str, threads: int = 0, embed_batch_size: int = 16, **kwargs):
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+
+            super().__init__(model_name=f"{BACKEND_ONNX_INT8}:{model_dir}", embed_batch_size=embed_batch_size, **kwargs)
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            # 单个会话的算子内并行线程数；多个 worker 共用一台机器时应按 worker 数均分 CPU 核
+            options.intra_op_num_threads = threads or (os.cpu_count() or 1)
+            options.inter_op_num_threads = 1
+            self._session = ort.InferenceSession(
+                str(Path(model_dir) / ONNX_INT8_FILE), sess_options=options, providers=["CPUExecutionProvider"]
+            )
+            self._tokenizer = AutoTokenizer.from_pretrained(model_dir)
+            self._input_names = [i.name for i in self._session.get_inputs()]
+
+        @classmethod
+        def class_name(cls) -> str:
+            return "OnnxEmbedding"
+
+        def _embed(self, texts: List[str]) -> List[List[float]]:
+            encoded = self._tokenizer(
+                texts, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np"
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self._input_names}
+            hidden = self._session.run(None, feeds)[0]
+            # mean pooling + L2 归一化，与 HuggingFaceEmbedding(normalize=True) 的输出对齐
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            return pooled.tolist()
+
+        def _get_query_embedding(self, query: str) -> List[float]:
+            return self._embed([query])[0]
+
+        def _get_text_embedding(self, text: str) -> List[float]:
+            return self._embed([text])[0]
+
+        def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+            return self._embed(texts)
+
+        async def _aget_query_embedding(self, query: str) -> List[float]:
+            return self._get_query_embedding(query)
+
+        async def _aget_text_embedding(self, text: str) -> List[float]:
+            return self._get_text_embedding(text)
+
+    return OnnxEmbedding
+
+
+def create_embed_model(
+    backend: str,
+    model_path: str,
+    device: Optional[str] = None,
+    embed_batch_size: int = 16,
+    onnx_dir: str = None,
+    onnx_threads: int = 0,
+):
+    """按后端名称创建 embedding 模型；onnx-int8 的导出目录不存在时先自动导出"""
+    if backend == BACKEND_TORCH:
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        return HuggingFaceEmbedding(model_name=model_path, device=device, embed_batch_size=embed_batch_size)
+
+    if backend == BACKEND_ONNX_INT8:
+        if not onnx_dir:
+            raise ValueError("onnx-int8 后端需要指定 onnx_dir")
+        if not (Path(onnx_dir) / ONNX_INT8_FILE).exists():
+            logger.warning(f"未找到 ONNX int8 模型，将从 {model_path} 导出到 {onnx_dir}")
+            export_onnx_int8(model_path, onnx_dir)
+        OnnxEmbedding = _build_onnx_embedding_class()
+        return OnnxEmbedding(onnx_dir, threads=onnx_threads, embed_batch_size=embed_batch_size)
+
+    raise ValueError(f"未知的 embedding 后端: {backend}，可选: {', '.join(BACKENDS)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 4 or sys.argv[1] != "export":
+        print("用法: python embedding_backends.py export <模型路径> <输出目录>")
+        sys.exit(1)
+    export_onnx_int8(sys.argv[2], sys.argv[3])
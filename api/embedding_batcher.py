@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询向量动态微批处理
+把几毫秒内并发到达的查询合并为一次前向计算，再把向量分发回各自等待的请求
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """已排序序列的分位数（最近秩法）"""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class EmbeddingBatcher:
+    """查询 embedding 的批处理调度器
+
+    请求先进入等待队列；队列达到 max_batch_size 时立即发车，否则最早的请求
+    等待 max_wait_ms 后发车。同一批内的重复文本只计算一次。
+    批次在 embedding 线程池中执行，线程池已满时整批请求收到 PoolSaturated。
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        pool,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        stats_window: int = 2048,
+    ):
+        self.embed_batch = embed_batch
+        self.pool = pool
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._pending = []
+        self._timer = None
+        self._stats_lock = threading.Lock()
+        self._queue_delays = deque(maxlen=stats_window)
+        self._batch_sizes = deque(maxlen=stats_window)
+        self.batches = 0
+        self.queries = 0
+
+    async def embed(self, text: str, timeout=None) -> List[float]:
+        """提交单条文本，返回其向量"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._dispatch)
+
+        # shield：单个请求超时不应取消同批其它请求共享的计算
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            asyncio.ensure_future(self._run_batch(batch))
+
+    def _embed_timed(self, texts: List[str], enqueued_at: List[float]) -> List[List[float]]:
+        """在工作线程内记录排队延迟（入队到前向计算开始）后执行批量 embedding"""
+        started = time.perf_counter()
+        with self._stats_lock:
+            self._queue_delays.extend(started - t for t in enqueued_at)
+        return self.embed_batch(texts)
+
+    async def _run_batch(self, batch):
+        unique_texts = list(dict.fromkeys(text for text, _, _ in batch))
+        enqueued_at = [t for _, _, t in batch]
+        try:
+            vectors = await self.pool.run(self._embed_timed, unique_texts, enqueued_at)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(unique_texts, vectors))
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+        with self._stats_lock:
+            self.batches += 1
+            self.queries += len(batch)
+            self._batch_sizes.append(len(unique_texts))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            delays = sorted(self._queue_delays)
+            sizes = list(self._batch_sizes)
+            batches, queries = self.batches, self.queries
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "queries": queries,
+            "pending": len(self._pending),
+            "avg_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+            "queue_delay_ms": {
+                "p50": round(percentile(delays, 50) * 1000.0, 3),
+                "p99": round(percentile(delays, 99) * 1000.0, 3),
+            },
+        }
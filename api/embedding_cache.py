@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询向量缓存
+规范化查询文本 → 向量，内存层按 LRU + TTL 淘汰并限制总字节数，
+可选的磁盘层是一个内存映射的定长哈希表，进程重启后仍然有效，并可被多个 uvicorn worker 共享
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCT = "？?。.!！~～；;，,、 "
+
+
+def normalize_query(text: str) -> str:
+    """查询文本规范化：全角转半角、合并空白、去除句末标点、英文小写"""
+    text = unicodedata.normalize("NFKC", text)
+    text = _WHITESPACE.sub(" ", text).strip().rstrip(_TRAILING_PUNCT)
+    return text.lower()
+
+
+class MmapEmbeddingStore:
+    """内存映射的向量哈希表
+
+    文件由 64 字节文件头和 slots 个定长槽位组成，每个槽位为
+    (key_hi, key_lo, expires_at, vector[dim])。按 key 线性探测 PROBE 个槽位。
+    写入顺序为“清空 key → 写向量 → 写 key”，读取时前后两次比对 key，
+    以检测并发写入造成的撕裂读；多进程写入是尽力而为的，不保证不丢条目。
+    """
+
+    MAGIC = b"KBEMB001"
+    HEADER_SIZE = 64
+    PROBE = 4
+
+    def __init__(self, path: str, model_id: str, slots: int = 16384):
+        self.path = Path(path)
+        self.model_hash = hashlib.blake2b(model_id.encode("utf-8"), digest_size=16).digest()
+        self.slots = slots
+        self.dim = None
+        self._table = None
+        self._stale = False
+        self._try_open()
+
+    def _record_dtype(self, dim: int):
+        return np.dtype([
+            ("key_hi", "<u8"),
+            ("key_lo", "<u8"),
+            ("expires_at", "<f8"),
+            ("vector", "<f4", (dim,)),
+        ])
+
+    def _header(self, dim: int) -> bytes:
+        header = self.MAGIC + dim.to_bytes(4, "little") + self.slots.to_bytes(4, "little") + self.model_hash
+        return header.ljust(self.HEADER_SIZE, b"\0")
+
+    def _try_open(self) -> bool:
+        """打开已有文件；文件头与当前模型、槽位数不一致时视为不可用，等待下次写入时重建"""
+        if self._stale or not self.path.exists():
+            return False
+        with open(self.path, "rb") as f:
+            header = f.read(self.HEADER_SIZE)
+        if len(header) < self.HEADER_SIZE or header[:8] != self.MAGIC:
+            return False
+        dim = int.from_bytes(header[8:12], "little")
+        if header != self._header(dim):
+            logger.warning(f"磁盘向量缓存与当前模型或槽位配置不一致，将重建: {self.path}")
+            self._stale = True
+            return False
+        self._map(dim)
+        return True
+
+    def _map(self, dim: int):
+        self.dim = dim
+        self._table = np.memmap(
+            self.path, dtype=self._record_dtype(dim), mode="r+",
+            offset=self.HEADER_SIZE, shape=(self.slots,)
+        )
+
+    def _create(self, dim: int):
+        """先写临时文件再原子替换，避免多个 worker 同时创建时读到半个文件"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        record_size = self._record_dtype(dim).itemsize
+        with open(tmp_path, "wb") as f:
+            f.write(self._header(dim))
+            f.truncate(self.HEADER_SIZE + record_size * self.slots)
+        os.replace(tmp_path, self.path)
+        self._stale = False
+        self._map(dim)
+        logger.info(f"已创建磁盘向量缓存: {self.path} ({self.slots} 槽位, dim={dim})")
+
+    def _probe(self, key: bytes):
+        hi = int.from_bytes(key[:8], "little")
+        lo = int.from_bytes(key[8:16], "little")
+        base = hi % self.slots
+        return hi, lo, [(base + i) % self.slots for i in range(self.PROBE)]
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        if self._table is None and not self._try_open():
+            return None
+        hi, lo, slots = self._probe(key)
+        now = time.time()
+        for slot in slots:
+            record = self._table[slot]
+            if record["key_hi"] != hi or record["key_lo"] != lo:
+                continue
+            if record["expires_at"] < now:
+                return None
+            vector = np.array(record["vector"], dtype=np.float32)
+            # 复制完成后再次确认 key 未被并发写入覆盖
+            if self._table[slot]["key_hi"] != hi or self._table[slot]["key_lo"] != lo:
+                return None
+            return vector
+        return None
+
+    def put(self, key: bytes, vector: np.ndarray, expires_at: float):
+        if self._table is None and not self._try_open():
+            self._create(len(vector))
+        if len(vector) != self.dim:
+            return
+        hi, lo, slots = self._probe(key)
+        target = None
+        oldest = None
+        for slot in slots:
+            record = self._table[slot]
+            if (record["key_hi"] == hi and record["key_lo"] == lo) or (record["key_hi"] == 0 and record["key_lo"] == 0):
+                target = slot
+                break
+            if oldest is None or record["expires_at"] < self._table[oldest]["expires_at"]:
+                oldest = slot
+        if target is None:
+            target = oldest
+
+        table = self._table
+        table["key_hi"][target] = 0
+        table["key_lo"][target] = 0
+        table["vector"][target] = vector
+        table["expires_at"][target] = expires_at
+        table["key_lo"][target] = lo
+        table["key_hi"][target] = hi
+
+    def flush(self):
+        if self._table is not None:
+            self._table.flush()
+
+
+class EmbeddingCache:
+    """查询向量缓存（内存 LRU/TTL 层 + 可选的内存映射磁盘层）
+
+    key 由 embedding 模型标识与规范化后的查询文本共同哈希得到，
+    更换模型后旧向量不会被误用。
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 86400.0,
+        disk_path: Optional[str] = None,
+        disk_slots: int = 16384,
+    ):
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.disk = MmapEmbeddingStore(disk_path, model_id, disk_slots) if disk_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, normalized: str) -> bytes:
+        return hashlib.blake2b(
+            f"{self.model_id}\0{normalized}".encode("utf-8"), digest_size=16
+        ).digest()
+
+    def get(self, normalized: str) -> Optional[List[float]]:
+        """按规范化文本查找向量，未命中返回 None"""
+        key = self.key(normalized)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, expires_at = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return vector.tolist()
+                self._remove(key)
+
+            if self.disk is not None:
+                vector = self.disk.get(key)
+                if vector is not None:
+                    self._insert(key, vector, now + self.ttl_seconds)
+                    self.disk_hits += 1
+                    return vector.tolist()
+
+            self.misses += 1
+            return None
+
+    def put(self, normalized: str, vector: List[float]):
+        key = self.key(normalized)
+        array = np.asarray(vector, dtype=np.float32)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._insert(key, array, expires_at)
+            if self.disk is not None:
+                try:
+                    self.disk.put(key, array, expires_at)
+                except OSError as e:
+                    logger.warning(f"写入磁盘向量缓存失败: {e}")
+
+    def _insert(self, key: bytes, vector: np.ndarray, expires_at: float):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (vector, expires_at)
+        self._bytes += vector.nbytes
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key: bytes):
+        vector, _ = self._entries.pop(key)
+        self._bytes -= vector.nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "model_id": self.model_id,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "disk_path": str(self.disk.path) if self.disk is not None else None,
+            }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.flush()
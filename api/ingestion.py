@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+统一的增量入库引擎
+加载 JSON → 按内容类型创建 TextNode → 与 Chroma 元数据中已存的内容哈希比对，
+只对新增或变更的节点做 embedding 并 upsert，删除数据源中已移除的节点。
+
+test/ 下的入库脚本只负责配置（数据文件、集合名、模型），入库逻辑统一在这里。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from article_lookup import ArticleIndex, article_index_path
+from embedding_backends import BACKEND_TORCH
+from json_stream import iter_json, json_shape
+
+logger = logging.getLogger(__name__)
+
+# 写入 Chroma 元数据的内容哈希字段
+HASH_KEY = "content_hash"
+# 未指定后端时每批 embedding 的节点数
+DEFAULT_BATCH_SIZE = 64
+# 写入者每次 bulk upsert 的节点数
+DEFAULT_UPSERT_BATCH_SIZE = 256
+# 分页读取已存哈希时每页的条数
+HASH_PAGE_SIZE = 1000
+
+CONTENT_TYPE_LEGAL_ARTICLE = "legal_article"
+CONTENT_TYPE_HISTORICAL_EVENT = "historical_event"
+CONTENT_TYPE_QA = "qa"
+# 问答集合中两类节点的 content_type（检索侧按 QA_QUESTION 把命中的问题换成回答，见 collection_registry）
+CONTENT_TYPE_QA_QUESTION = "qa_question"
+CONTENT_TYPE_QA_ANSWER = "qa_answer"
+
+
+def _node_id(source_file: str, title: str) -> str:
+    return f"{source_file}_{title.replace(' ', '_')}"
+
+
+def legal_article_nodes(items: Iterable[Tuple[str, str]], source_file: str) -> Iterator:
+    """法条：标题形如 "中华人民共和国劳动法 第一条"，拆出法律名与条款号"""
+    from llama_index.core.schema import TextNode
+
+    for key, value in items:
+        if not isinstance(value, str) or not value.strip():
+            continue
+        parts = key.split(' ', 1)
+        law_name = parts[0] if len(parts) > 0 else "未知法律"
+        article = parts[1] if len(parts) > 1 else "未知条款"
+        yield TextNode(
+            id_=_node_id(source_file, key),
+            text=value,
+            metadata={
+                "law_name": law_name,
+                "article": article,
+                "full_title": key,
+                "source_file": source_file,
+                "content_type": CONTENT_TYPE_LEGAL_ARTICLE
+            }
+        )
+
+
+def historical_event_nodes(items: Iterable[Tuple[str, str]], source_file: str) -> Iterator:
+    """历史事件：标题即事件名"""
+    from llama_index.core.schema import TextNode
+
+    for event_title, event_description in items:
+        if not isinstance(event_description, str) or not event_description.strip():
+            continue
+        yield TextNode(
+            id_=_node_id(source_file, event_title),
+            text=event_description,
+            metadata={
+                "event_title": event_title,
+                "full_title": event_title,
+                "source_file": source_file,
+                "content_type": CONTENT_TYPE_HISTORICAL_EVENT
+            }
+        )
+
+
+def _qa_pair(source_file: str, node_id: str, question: str, answer: str, extra: dict) -> list:
+    """一组问答的双路索引节点：问题节点只用问题文本做 embedding，并通过 answer_id 指向回答节点"""
+    from llama_index.core.schema import TextNode
+
+    link_keys = ["question_id", "answer_id", "conversation_id", "turn", "source_file", "content_type"]
+    question_node = TextNode(
+        id_=f"{node_id}_q",
+        text=question,
+        metadata=dict(extra, **{
+            "answer_id": f"{node_id}_a",
+            "full_title": question,
+            "source_file": source_file,
+            "content_type": CONTENT_TYPE_QA_QUESTION
+        })
+    )
+    question_node.excluded_embed_metadata_keys = list(question_node.metadata)
+    answer_node = TextNode(
+        id_=f"{node_id}_a",
+        text=answer,
+        metadata=dict(extra, **{
+            "question_id": f"{node_id}_q",
+            "full_title": question,
+            "source_file": source_file,
+            "content_type": CONTENT_TYPE_QA_ANSWER
+        })
+    )
+    answer_node.excluded_embed_metadata_keys = [k for k in answer_node.metadata if k in link_keys]
+    return [question_node, answer_node]
+
+
+def qa_nodes(records: Iterable[dict], source_file: str) -> Iterator:
+    """指令问答（fintech.json）：问题与回答分别建节点双路索引，history 中的每轮问答作为额外入口"""
+    for record in records:
+        question = "\n".join(part for part in (record.get("instruction"), record.get("input")) if part)
+        answer = record.get("output")
+        if not question.strip() or not isinstance(answer, str) or not answer.strip():
+            continue
+        conversation_id = f"{source_file}_qa_{hashlib.sha1(question.encode('utf-8')).hexdigest()[:16]}"
+        yield from _qa_pair(source_file, conversation_id, question, answer, {"conversation_id": conversation_id})
+
+        for turn, pair in enumerate(record.get("history") or []):
+            if not isinstance(pair, (list, tuple)) or len(pair) != 2 or not all(isinstance(p, str) and p.strip() for p in pair):
+                continue
+            yield from _qa_pair(
+                source_file, f"{conversation_id}_h{turn}", pair[0], pair[1],
+                {"conversation_id": conversation_id, "turn": turn}
+            )
+
+
+# 内容类型 → (数据文件的顶层形态, 节点构建函数)
+# object 形态的构建函数接收 (key, value) 序列，array 形态的接收元素序列，均由 iter_json 流式产出
+ADAPTERS: Dict[str, Tuple[str, Callable[[Iterable, str], Iterator]]] = {
+    CONTENT_TYPE_LEGAL_ARTICLE: ("object", legal_article_nodes),
+    CONTENT_TYPE_HISTORICAL_EVENT: ("object", historical_event_nodes),
+    CONTENT_TYPE_QA: ("array", qa_nodes),
+}
+
+
+def _embed_text(node) -> str:
+    """与 VectorStoreIndex 构建索引时一致的 embedding 输入（正文 + 参与 embedding 的元数据）"""
+    from llama_index.core.schema import MetadataMode
+    return node.get_content(metadata_mode=MetadataMode.EMBED)
+
+
+def content_hash(node) -> str:
+    """节点内容哈希：覆盖 embedding 输入、正文与全部元数据，任何一项变化都会触发重新入库"""
+    metadata = {k: v for k, v in node.metadata.items() if k != HASH_KEY}
+    payload = json.dumps(
+        {"embed": _embed_text(node), "text": node.text, "metadata": metadata},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _stamp(node) -> str:
+    """计算哈希并写入元数据；哈希字段不参与 embedding 和 LLM 上下文"""
+    digest = content_hash(node)
+    node.metadata[HASH_KEY] = digest
+    for keys in (node.excluded_embed_metadata_keys, node.excluded_llm_metadata_keys):
+        if HASH_KEY not in keys:
+            keys.append(HASH_KEY)
+    return digest
+
+
+def get_or_create_collection(client, name: str, content_type: Optional[str] = None):
+    """余弦距离集合；内容类型记录在集合元数据 kb_content_type 中（仅在创建时写入）"""
+    metadata = {"hnsw:space": "cosine"}
+    if content_type:
+        metadata["kb_content_type"] = content_type
+    return client.get_or_create_collection(name=name, metadata=metadata)
+
+
+def stored_hashes(collection) -> Dict[str, Optional[str]]:
+    """分页读取集合中全部节点 id 及其内容哈希（旧脚本写入的节点没有哈希，值为 None）"""
+    hashes = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=HASH_PAGE_SIZE, offset=offset)
+        ids = page["ids"]
+        for node_id, metadata in zip(ids, page["metadatas"]):
+            hashes[node_id] = (metadata or {}).get(HASH_KEY)
+        if len(ids) < HASH_PAGE_SIZE:
+            return hashes
+        offset += len(ids)
+
+
+def write_nodes(collection, nodes: List, embeddings: List[List[float]]):
+    """把一批已完成 embedding 的节点 upsert 到 Chroma，写入格式与 ChromaVectorStore.add 相同"""
+    from llama_index.core.schema import MetadataMode
+    from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+    collection.upsert(
+        ids=[node.node_id for node in nodes],
+        embeddings=embeddings,
+        metadatas=[node_to_metadata_dict(node, remove_text=True, flat_metadata=True) for node in nodes],
+        documents=[node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes]
+    )
+
+
+def upsert_nodes(collection, nodes: List, embed_model):
+    """对一批节点做 embedding 并 upsert"""
+    write_nodes(collection, nodes, embed_model.get_text_embedding_batch([_embed_text(node) for node in nodes]))
+
+
+def default_batch_size(backend: str, device: Optional[str] = None) -> int:
+    """各后端的 embedding 批大小：GPU 上的 torch 用大批次，CPU 推理（torch 或 onnx-int8）超过 32 后几乎没有收益"""
+    if backend == BACKEND_TORCH and device and device.startswith("cuda"):
+        return 128
+    return 32
+
+
+def embed_spec_for(
+    backend: str,
+    model_path: str,
+    workers: int = 0,
+    device: Optional[str] = None,
+    onnx_dir: Optional[str] = None,
+) -> dict:
+    """入库用的 create_embed_model 参数：批大小按后端取值，onnx 会话线程数按进程数均分 CPU 核"""
+    return {
+        "backend": backend,
+        "model_path": model_path,
+        "device": device,
+        "embed_batch_size": default_batch_size(backend, device),
+        "onnx_dir": onnx_dir,
+        "onnx_threads": max(1, (os.cpu_count() or 1) // max(workers, 1)),
+    }
+
+
+# 工作进程内常驻的 embedding 模型
+_worker_model = None
+
+
+def _init_worker(embed_spec: dict):
+    """工作进程初始化：每个进程按 embed_spec 创建一份自己的 embedding 模型"""
+    global _worker_model
+    from embedding_backends import create_embed_model
+    _worker_model = create_embed_model(**embed_spec)
+
+
+def _embed_in_worker(texts: List[str]) -> List[List[float]]:
+    return _worker_model.get_text_embedding_batch(texts)
+
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _checkpoint_path(chroma_path, collection_name: str) -> Path:
+    return Path(chroma_path) / f".ingest_{collection_name}.pending"
+
+
+class _Writer:
+    """单一写入者：缓冲已完成 embedding 的节点，攒够 upsert_batch_size 后一次 bulk upsert，并统计吞吐
+
+    提供 chroma_path 时，首次写入前落一个未完成标记，全部完成后删除；
+    进程中途被中断时，已写入的批次带着内容哈希留在 Chroma 中，下次运行会被判定为未变而跳过，
+    只需继续处理剩余节点。
+    """
+
+    def __init__(self, collection, collection_name: str, upsert_batch_size: int, chroma_path=None):
+        self.collection = collection
+        self.collection_name = collection_name
+        self.upsert_batch_size = upsert_batch_size
+        self.checkpoint = _checkpoint_path(chroma_path, collection_name) if chroma_path is not None else None
+        self.resumed = self.checkpoint is not None and self.checkpoint.exists()
+        if self.resumed:
+            logger.warning(f"检测到集合 '{collection_name}' 上次入库未完成，继续处理剩余节点")
+        self._nodes: List = []
+        self._embeddings: List[List[float]] = []
+        self.written = 0
+        self.started = None
+
+    def add(self, nodes: List, embeddings: List[List[float]]):
+        if self.started is None:
+            self.started = time.perf_counter()
+        self._nodes.extend(nodes)
+        self._embeddings.extend(embeddings)
+        if len(self._nodes) >= self.upsert_batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._nodes:
+            return
+        if self.checkpoint is not None and not self.checkpoint.exists():
+            self.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+            self.checkpoint.write_text(time.strftime("%Y-%m-%d %H:%M:%S"), encoding="utf-8")
+        write_nodes(self.collection, self._nodes, self._embeddings)
+        self.written += len(self._nodes)
+        self._nodes, self._embeddings = [], []
+        logger.info(f"已写入 {self.written} 个节点，{self.docs_per_second():.1f} docs/s")
+
+    def docs_per_second(self) -> float:
+        if self.started is None or not self.written:
+            return 0.0
+        return self.written / max(time.perf_counter() - self.started, 1e-9)
+
+    def finish(self):
+        """写入完成（版本戳已更新）后删除未完成标记"""
+        if self.checkpoint is not None and self.checkpoint.exists():
+            self.checkpoint.unlink()
+
+
+def _embed_serial(batches: Iterator[List], embed_model, writer: _Writer):
+    for batch in batches:
+        writer.add(batch, embed_model.get_text_embedding_batch([_embed_text(node) for node in batch]))
+
+
+def _embed_parallel(batches: Iterator[List], workers: int, embed_spec: dict, writer: _Writer):
+    """把批次分发到进程池，每个进程一份模型；主进程只做 upsert，在途批次数受限以控制内存"""
+    max_in_flight = workers * 2
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(embed_spec,)) as executor:
+        for batch in batches:
+            future = executor.submit(_embed_in_worker, [_embed_text(node) for node in batch])
+            in_flight[future] = batch
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    writer.add(in_flight.pop(future), future.result())
+        for future in as_completed(list(in_flight)):
+            writer.add(in_flight.pop(future), future.result())
+
+
+def ingest_nodes(
+    client,
+    collection_name: str,
+    nodes: Iterable,
+    embed_model=None,
+    chroma_path=None,
+    batch_size: Optional[int] = None,
+    rebuild: bool = False,
+    node_store=None,
+    workers: int = 0,
+    embed_spec: Optional[dict] = None,
+    upsert_batch_size: int = DEFAULT_UPSERT_BATCH_SIZE,
+    content_type: Optional[str] = None,
+    snapshot_dir=None,
+) -> dict:
+    """增量同步一个集合，返回新增/更新/未变/删除的节点数、吞吐与耗时
+
+    nodes 可以是生成器；内存中只保留已存哈希表与在途的若干批节点。
+    workers > 1 时按 embed_spec（create_embed_model 的参数）在进程池中并行 embedding，
+    否则在当前进程中用 embed_model（默认 Settings.embed_model）串行 embedding。
+    集合有任何写入时调用 bump_version 通知检索 API 失效缓存（需提供 chroma_path）；
+    集合中有法条时同时在 chroma_path 下写入 (法律名, 条号) → node_id 的条文索引（见 article_lookup），
+    并为集合计算分数分布画像（见 score_profile），检索 API 据此确定集合的默认相似度阈值。
+    正文与元数据只写入 Chroma；提供 node_store（SqliteNodeStore）时额外按 node_id 同步一份，
+    只写入其中缺失或内容哈希不同的节点，并删除数据源中已不存在的节点。
+    提供 snapshot_dir 时，快照缺失或与当前版本戳不一致则重新导出集合的向量快照（见 vector_snapshot）
+    与 BM25 稀疏索引（见 sparse_index）。
+    """
+    parallel = workers > 1
+    if parallel and not embed_spec:
+        raise ValueError("并行入库需要提供 embed_spec")
+    if not parallel and embed_model is None:
+        from llama_index.core import Settings
+        embed_model = Settings.embed_model
+    if batch_size is None:
+        batch_size = default_batch_size(embed_spec.get("backend"), embed_spec.get("device")) if embed_spec else DEFAULT_BATCH_SIZE
+
+    started = time.perf_counter()
+    if rebuild and collection_name in [c.name for c in client.list_collections()]:
+        logger.warning(f"全量重建，删除已存在的集合: {collection_name}")
+        client.delete_collection(name=collection_name)
+    collection = get_or_create_collection(client, collection_name, content_type)
+    existing = stored_hashes(collection)
+    logger.info(f"集合 '{collection_name}' 已有 {len(existing)} 个节点")
+
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    seen = set()
+    store_pending = []
+    articles = ArticleIndex(collection_id=str(collection.id))
+
+    def changed_nodes():
+        for node in nodes:
+            if node.node_id in seen:
+                logger.warning(f"重复的节点 id，已跳过: {node.node_id}")
+                continue
+            seen.add(node.node_id)
+            if node.metadata.get("content_type") == CONTENT_TYPE_LEGAL_ARTICLE:
+                articles.add(node.node_id, node.metadata)
+            digest = _stamp(node)
+            if node_store is not None and node_store.content_hash_of(node.node_id) != digest:
+                store_pending.append(node)
+                if len(store_pending) >= upsert_batch_size:
+                    node_store.put_many(store_pending, HASH_KEY)
+                    store_pending.clear()
+            if node.node_id not in existing:
+                stats["added"] += 1
+            elif existing[node.node_id] != digest:
+                stats["updated"] += 1
+            else:
+                stats["unchanged"] += 1
+                continue
+            yield node
+
+    writer = _Writer(collection, collection_name, upsert_batch_size, chroma_path)
+    batches = _batched(changed_nodes(), batch_size)
+    if parallel:
+        logger.info(f"并行 embedding: {workers} 个进程，批大小 {batch_size}")
+        _embed_parallel(batches, workers, embed_spec, writer)
+    else:
+        _embed_serial(batches, embed_model, writer)
+    writer.flush()
+
+    removed = [node_id for node_id in existing if node_id not in seen]
+    for batch in _batched(removed, HASH_PAGE_SIZE):
+        collection.delete(ids=batch)
+    stats["deleted"] = len(removed)
+
+    if node_store is not None:
+        node_store.put_many(store_pending, HASH_KEY)
+        node_store.delete_many([node_id for node_id in node_store.node_ids() if node_id not in seen])
+
+    if chroma_path is not None and (writer.written or stats["deleted"] or rebuild or writer.resumed):
+        from kb_versions import bump_version
+        bump_version(chroma_path, collection_name)
+    writer.finish()
+    if chroma_path is not None and len(articles):
+        from kb_versions import read_versions
+        articles.version = read_versions(chroma_path).get(collection_name, {}).get("version", 0)
+        articles.save(article_index_path(chroma_path, collection_name))
+    if chroma_path is not None:
+        refresh_profile(collection, chroma_path)
+    if snapshot_dir:
+        refresh_snapshot(collection, snapshot_dir, chroma_path)
+
+    stats["total"] = len(seen)
+    stats["docs_per_second"] = round(writer.docs_per_second(), 2)
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(
+        f"集合 '{collection_name}' 入库完成: 新增 {stats['added']}, 更新 {stats['updated']}, "
+        f"未变 {stats['unchanged']}, 删除 {stats['deleted']}, "
+        f"吞吐 {stats['docs_per_second']} docs/s, 耗时 {stats['elapsed_ms']} ms"
+    )
+    return stats
+
+
+def refresh_snapshot(collection, snapshot_dir, chroma_path=None) -> bool:
+    """向量快照或 BM25 稀疏索引缺失、属于已删除重建前的集合或版本戳落后时重新导出，返回是否导出"""
+    from kb_versions import read_versions
+    from sparse_index import SparseIndex, read_stamp, sparse_index_path
+    from vector_snapshot import export_collection, read_header, snapshot_path
+
+    version = read_versions(chroma_path).get(collection.name, {}).get("version", 0) if chroma_path is not None else 0
+    stamp = (version, str(collection.id))
+    path = snapshot_path(snapshot_dir, collection.name)
+    header = read_header(path)
+    sparse_path = sparse_index_path(snapshot_dir, collection.name)
+    exported = False
+    if header is None or (header["version"], header.get("collection_id")) != stamp:
+        export_collection(collection, path, version)
+        exported = True
+    if read_stamp(sparse_path) != stamp:
+        SparseIndex.from_collection(collection, version=version).save(sparse_path)
+        exported = True
+    return exported
+
+
+def refresh_profile(collection, chroma_path) -> bool:
+    """分数画像缺失、属于已删除重建前的集合或版本戳落后时重新计算，返回是否重新计算"""
+    from kb_versions import read_versions
+    from score_profile import ScoreProfile, profile_path
+
+    version = read_versions(chroma_path).get(collection.name, {}).get("version", 0)
+    path = profile_path(chroma_path, collection.name)
+    profile = ScoreProfile.load(path)
+    if profile is not None and (profile.version, profile.collection_id) == (version, str(collection.id)):
+        return False
+    ScoreProfile.from_collection(collection, version=version).save(path)
+    return True
+
+
+def file_nodes(paths: Iterable, content_type: str = CONTENT_TYPE_LEGAL_ARTICLE) -> Iterator:
+    """依次流式读取多个数据文件并按内容类型生成节点，内存占用与文件大小无关"""
+    if content_type not in ADAPTERS:
+        raise ValueError(f"未知的内容类型: {content_type}，可选: {', '.join(ADAPTERS)}")
+    shape, adapter = ADAPTERS[content_type]
+    for path in paths:
+        path = Path(path)
+        if json_shape(path) != shape:
+            raise ValueError(f"数据文件 {path} 的顶层不是 {shape}，与内容类型 {content_type} 不符")
+        logger.info(f"正在从 '{path}' 流式读取数据...")
+        yield from adapter(iter_json(path), path.name)
+
+
+def ingest_files(
+    client,
+    collection_name: str,
+    paths: Iterable,
+    content_type: str = CONTENT_TYPE_LEGAL_ARTICLE,
+    **kwargs,
+) -> dict:
+    """把一个或多个数据文件增量同步到同一个集合"""
+    return ingest_nodes(client, collection_name, file_nodes(paths, content_type), content_type=content_type, **kwargs)
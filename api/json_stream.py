@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式 JSON 读取
+按块读取文件，逐个解析顶层对象的键值对或顶层数组的元素，内存中只保留当前一项和一个读取块，
+与文件大小无关。支持入库数据的两种形态：
+- {标题: 正文} 的扁平对象（劳动法.json、jinxiandaishi_event.json），产出 (key, value)
+- [{instruction, input, output, history}, ...] 的数组（fintech.json），产出每个元素
+"""
+
+import json
+from typing import Any, Iterator
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+class _Reader:
+    """带缓冲的字符读取器，解析位置之前的内容会被及时丢弃"""
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """丢弃已解析部分并追加一块数据，到达文件末尾时返回 False"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """跳过空白并返回下一个字符，文件结束时返回空串"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"JSON 格式错误: 期望 {chars!r}，实际为 {ch or '文件结束'!r}")
+        self.pos += 1
+        return ch
+
+    def value(self, decoder: json.JSONDecoder) -> Any:
+        """解析下一个完整的 JSON 值，数据不足时继续读取"""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # 值恰好在缓冲区末尾结束，或数字后紧跟数字字符（如 "-1" 与 ".5e3" 被读取块截断）时，可能还有后续字符未读入
+            truncated = end == len(self.buffer) or (
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                and self.buffer[end] in _NUMBER_CHARS
+            )
+            if truncated and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_container(f, chunk_size: int) -> Iterator[Any]:
+    reader = _Reader(f, chunk_size)
+    decoder = json.JSONDecoder()
+    opening = reader.expect("{[")
+    closing = "}" if opening == "{" else "]"
+
+    if reader.peek() == closing:
+        reader.pos += 1
+        return
+    while True:
+        if opening == "{":
+            key = reader.value(decoder)
+            if not isinstance(key, str):
+                raise ValueError("JSON 格式错误: 对象的键必须是字符串")
+            reader.expect(":")
+            yield key, reader.value(decoder)
+        else:
+            yield reader.value(decoder)
+        if reader.expect("," + closing) == closing:
+            return
+
+
+def iter_json(path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    """流式读取顶层对象（产出 (key, value)）或顶层数组（产出元素）"""
+    with open(path, "r", encoding="utf-8") as f:
+        yield from _iter_container(f, chunk_size)
+
+
+def json_shape(path) -> str:
+    """只读取首个非空白字符判断顶层形态：object 或 array"""
+    with open(path, "r", encoding="utf-8") as f:
+        reader = _Reader(f, 1024)
+        ch = reader.peek()
+    if ch == "{":
+        return "object"
+    if ch == "[":
+        return "array"
+    raise ValueError(f"不支持的 JSON 顶层类型: {path}")
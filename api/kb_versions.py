@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+集合版本戳
+入库脚本每次写入集合后调用 bump_version，API 进程通过 VersionTracker 感知变化并失效缓存。
+版本戳保存在 ChromaDB 目录下的 kb_versions.json 中，跨进程共享
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_FILE_NAME = "kb_versions.json"
+
+
+def versions_path(chroma_path) -> Path:
+    return Path(chroma_path) / VERSIONS_FILE_NAME
+
+
+def read_versions(chroma_path) -> Dict[str, dict]:
+    path = versions_path(chroma_path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取版本戳文件失败 {path}: {e}")
+        return {}
+
+
+def bump_version(chroma_path, collection_name: str) -> int:
+    """集合被写入（新增、更新、删除、重建）后递增其版本戳，返回新版本号
+
+    版本号取 max(旧版本 + 1, 当前毫秒时间戳)，即使并发写入丢失一次更新，
+    后续写入得到的版本号也不会与旧缓存条目重复。
+    """
+    path = versions_path(chroma_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    versions = read_versions(chroma_path)
+    old = versions.get(collection_name, {}).get("version", 0)
+    new = max(old + 1, int(time.time() * 1000))
+    versions[collection_name] = {"version": new, "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(versions, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"集合 '{collection_name}' 版本戳已更新: {new}")
+    return new
+
+
+class VersionTracker:
+    """API 侧的版本戳读取器，最多每 check_interval 秒检查一次文件修改时间"""
+
+    def __init__(self, chroma_path, check_interval: float = 1.0):
+        self.chroma_path = chroma_path
+        self.check_interval = check_interval
+        self._versions: Dict[str, dict] = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = versions_path(self.chroma_path).stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._mtime:
+            self._versions = read_versions(self.chroma_path) if mtime is not None else {}
+            self._mtime = mtime
+
+    def get(self, collection_name: str) -> int:
+        """集合当前版本号，从未入库过的集合为 0"""
+        with self._lock:
+            self._refresh()
+            return self._versions.get(collection_name, {}).get("version", 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            self._refresh()
+            return {name: v.get("version", 0) for name, v in self._versions.items()}
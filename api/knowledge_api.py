@@ -5,31 +5,45 @@
 提供基于 LlamaIndex + ChromaDB 的知识库检索功能
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Callable, Dict, List, Literal, Optional, Union
+import asyncio
+import functools
+import heapq
+import json
 import logging
 import os
 import sys
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
 # 添加项目根目录到 Python 跻径
 current_dir = Path(__file__).parent
 project_root = current_dir.parent
 sys.path.append(str(project_root))
+sys.path.append(str(current_dir))
 
-try:
-    from llama_index.vector_stores.chroma import ChromaVectorStore
-    from llama_index.core import StorageContext, VectorStoreIndex, Settings
-    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-    from llama_index.core.llms import MockLLM # 修正导入路径
-    import chromadb
-    import torch
-except ImportError as e:
-    print(f"请安装必要的依赖: {e}")
-    print("pip install llama-index chromadb sentence-transformers torch")
-    sys.exit(1)
+# 这里只导入轻量的本地模块；llama_index、chromadb、torch 等重量级依赖在 init_knowledge_base 中延迟导入，
+# 进程启动后即可响应存活探针，模型可在后台加载
+from collection_registry import CollectionRegistry
+from worker_pools import BoundedPool, PoolSaturated
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache, normalize_query
+from kb_versions import VersionTracker
+from result_cache import ResultCache
+from semantic_cache import SemanticCache
+from article_lookup import ARTICLE_PATTERN
+from embedding_backends import BACKENDS, create_embed_model
+from exact_search import ENGINES
+from metadata_filter import FilterError, parse_filter
+from result_packing import EMPTY, PackedDocuments, pack_hits, response_json
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, process_rss_bytes
+from request_profiling import ProfileSampler, RequestTrace, current_trace, tracing
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -41,6 +55,72 @@ CHROMADB_PATH = str(project_root / "test" / "chroma")
 # COLLECTION_NAME = 'laodongfa'
 MODEL_PATH = r'D:\llama index\sentence-transformers\paraphrase-multilingual-MiniLM-L12-v2'
 
+# embedding 后端：torch（默认）或 onnx-int8；onnx-int8 的模型目录不存在时启动时自动导出
+EMBED_BACKEND = os.getenv("KB_EMBED_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("KB_ONNX_MODEL_DIR", str(project_root / "models" / "minilm-onnx-int8"))
+ONNX_THREADS = int(os.getenv("KB_ONNX_THREADS", "0"))
+
+# 启动模式：background 时模型在后台线程加载，/ready 在加载完成前返回 503；blocking 时在启动钩子中同步加载
+STARTUP_MODE = os.getenv("KB_STARTUP_MODE", "background")
+# 启动预热：预先计算这些查询的向量（以 | 分隔）并打开这些集合（以逗号分隔，all 表示全部集合）
+WARMUP_QUERIES = [q for q in os.getenv("KB_WARMUP_QUERIES", "").split("|") if q.strip()]
+WARMUP_COLLECTIONS = [c.strip() for c in os.getenv("KB_WARMUP_COLLECTIONS", "").split(",") if c.strip()]
+
+# 集合句柄缓存配置：最多常驻的集合数，以及命中时向 Chroma 复核集合是否被删除/重建的间隔
+COLLECTION_CACHE_SIZE = int(os.getenv("KB_COLLECTION_CACHE_SIZE", "16"))
+COLLECTION_REVALIDATE_SECONDS = float(os.getenv("KB_COLLECTION_REVALIDATE_SECONDS", "5"))
+
+# 检索引擎：auto 时向量数不超过 EXACT_SEARCH_MAX_VECTORS 的集合载入内存矩阵做精确暴力检索，
+# 更大的集合走 Chroma 的 HNSW；exact / hnsw 强制使用其中一种。分界点可用 test/bench_search_engines.py 测定
+SEARCH_ENGINE = os.getenv("KB_SEARCH_ENGINE", "auto")
+EXACT_SEARCH_MAX_VECTORS = int(os.getenv("KB_EXACT_SEARCH_MAX_VECTORS", "10000"))
+EXACT_SEARCH_DTYPE = os.getenv("KB_EXACT_SEARCH_DTYPE", "float32")
+# 向量快照目录：其中有与当前版本戳一致的 <集合名>.kbsnap 时，精确检索直接 mmap 快照，
+# 多个 worker 共享同一份物理内存页且无需从 Chroma 读取向量（导出见 vector_snapshot.py）
+SNAPSHOT_DIR = os.getenv("KB_SNAPSHOT_DIR", "")
+
+# 相似度阈值：请求未指定 similarity_threshold 时使用集合分数画像给出的自适应阈值（见 score_profile），
+# KB_AUTO_THRESHOLD=0 或画像不可用时使用全局默认值
+DEFAULT_SIMILARITY_THRESHOLD = float(os.getenv("KB_DEFAULT_SIMILARITY_THRESHOLD", "0.65"))
+AUTO_THRESHOLD = os.getenv("KB_AUTO_THRESHOLD", "1") != "0"
+
+# 执行模型配置：embedding 计算（CPU 密集）与 Chroma 查询（I/O）分别使用独立的有界线程池，
+# 排队超过上限时直接返回 503，单个请求整体超过 REQUEST_TIMEOUT_SECONDS 返回 504
+EMBED_WORKERS = int(os.getenv("KB_EMBED_WORKERS", "2"))
+EMBED_QUEUE_SIZE = int(os.getenv("KB_EMBED_QUEUE_SIZE", "32"))
+SEARCH_WORKERS = int(os.getenv("KB_SEARCH_WORKERS", "8"))
+SEARCH_QUEUE_SIZE = int(os.getenv("KB_SEARCH_QUEUE_SIZE", "64"))
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("KB_REQUEST_TIMEOUT_SECONDS", "10"))
+RETRY_AFTER_SECONDS = 1
+
+# 查询向量微批处理：等待最多 EMBED_BATCH_MAX_WAIT_MS 毫秒凑满 EMBED_BATCH_MAX_SIZE 条查询后一次前向计算
+EMBED_BATCH_MAX_SIZE = int(os.getenv("KB_EMBED_BATCH_MAX_SIZE", "16"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("KB_EMBED_BATCH_MAX_WAIT_MS", "5"))
+
+# 查询向量缓存：内存层的字节上限与过期时间；KB_EMBED_CACHE_DISK_PATH 非空时启用内存映射磁盘层，
+# 多个 uvicorn worker 指向同一文件即可共享缓存
+EMBED_CACHE_MAX_MB = float(os.getenv("KB_EMBED_CACHE_MAX_MB", "64"))
+EMBED_CACHE_TTL_SECONDS = float(os.getenv("KB_EMBED_CACHE_TTL_SECONDS", "86400"))
+EMBED_CACHE_DISK_PATH = os.getenv("KB_EMBED_CACHE_DISK_PATH", "")
+EMBED_CACHE_DISK_SLOTS = int(os.getenv("KB_EMBED_CACHE_DISK_SLOTS", "16384"))
+
+# 检索结果缓存：条目携带集合版本戳，入库脚本写入集合后版本戳变化，旧结果不再返回
+RESULT_CACHE_SIZE = int(os.getenv("KB_RESULT_CACHE_SIZE", "2048"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("KB_RESULT_CACHE_TTL_SECONDS", "600"))
+VERSION_CHECK_SECONDS = float(os.getenv("KB_VERSION_CHECK_SECONDS", "1"))
+# 语义缓存：同一集合、同样检索参数下，查询向量与已缓存查询的余弦距离不超过 SEMANTIC_CACHE_MAX_DISTANCE 时复用其结果；
+# KB_SEMANTIC_CACHE_SIZE=0 时关闭
+SEMANTIC_CACHE_SIZE = int(os.getenv("KB_SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_MAX_DISTANCE = float(os.getenv("KB_SEMANTIC_CACHE_MAX_DISTANCE", "0.05"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("KB_SEMANTIC_CACHE_TTL_SECONDS", "600"))
+
+# 批量检索接口单次最多接受的请求数
+MAX_BATCH_REQUESTS = int(os.getenv("KB_MAX_BATCH_REQUESTS", "64"))
+
+# 抽样剖析：/retrieve 每 KB_PROFILE_SAMPLE_EVERY 个请求对其中一个做 cProfile，结果写入 KB_PROFILE_DIR；0 为关闭
+PROFILE_SAMPLE_EVERY = int(os.getenv("KB_PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_DIR = os.getenv("KB_PROFILE_DIR", str(project_root / "profiles"))
+
 # 如果模型路径不存在，使用在线模型
 if not Path(MODEL_PATH).exists():
     MODEL_PATH = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
@@ -67,59 +147,475 @@ class RetrieveRequest(BaseModel):
     collection_name: str = Field(..., description="要查询的知识库集合名称")
     top_k: int = Field(default=5, ge=1, le=20, description="返回文档数量")
     max_length: int = Field(default=3000, ge=100, le=10000, description="最大内容长度")
-    similarity_threshold: float = Field(default=0.65, ge=0, le=1, description="相似度阈值，只返回高于此分数的文档")
+    similarity_threshold: Optional[float] = Field(default=None, ge=0, le=1, description="相似度阈值，只返回高于此分数的文档；未指定时使用集合的自适应阈值")
+    search_mode: Literal["dense", "hybrid"] = Field(default="dense", description="检索模式：dense 纯向量检索；hybrid 融合 BM25 字符二元组词法排名与向量排名（分数仍为向量相似度）")
+    prefilter: bool = Field(default=False, description="hybrid 模式下只对词法检索的候选计算向量相似度，省去对整个集合的向量检索")
+    filter: Optional[str] = Field(default=None, description="元数据过滤表达式，如 content_type == 'legal_article' 或 law_name in ['中华人民共和国劳动法']，在检索前下推执行")
+    debug: bool = Field(default=False, description="为 true 时 /retrieve 的响应附带 timings：各阶段耗时与阈值过滤前后的候选数")
 
 class DocumentResult(BaseModel):
     content: str = Field(..., description="文档内容")
     source: str = Field(..., description="文档来源")
     title: Optional[str] = Field(None, description="文档标题")
     score: Optional[float] = Field(None, description="相似度分数")
+    collection: Optional[str] = Field(None, description="文档所属集合（多集合检索时返回）")
+
+class RetrieveTimings(BaseModel):
+    total_us: int = Field(..., description="请求开始到生成响应（不含响应序列化）的耗时（微秒）")
+    stages_us: Dict[str, int] = Field(..., description="各阶段耗时（微秒）：collection_open / article_lookup / embed / search / postprocess")
+    cache: Optional[str] = Field(None, description="命中的缓存：result / semantic，未命中为 null")
+    threshold: Optional[float] = Field(None, description="实际使用的相似度阈值")
+    candidates: Dict[str, int] = Field(..., description="候选数：retrieved（检索返回）/ above_threshold（通过阈值）/ returned（长度预算装填后）；命中缓存时只有 returned")
 
 class RetrieveResponse(BaseModel):
     documents: List[DocumentResult] = Field(..., description="检索到的文档列表")
     total: int = Field(..., description="总文档数量")
     query: str = Field(..., description="原始查询")
+    timings: Optional[RetrieveTimings] = Field(None, description="请求带 debug 时返回的耗时分解")
+
+class MultiRetrieveRequest(BaseModel):
+    query: str = Field(..., description="查询问题")
+    collection_names: Union[List[str], str] = Field(default="all", description="要同时检索的集合名称列表，\"all\" 表示全部集合")
+    top_k: int = Field(default=5, ge=1, le=20, description="合并后返回的文档数量")
+    max_length: int = Field(default=3000, ge=100, le=10000, description="最大内容长度")
+    similarity_threshold: Optional[float] = Field(default=None, ge=0, le=1, description="相似度阈值，只返回高于此分数的文档；未指定时使用集合的自适应阈值")
+    search_mode: Literal["dense", "hybrid"] = Field(default="dense", description="检索模式，同 RetrieveRequest.search_mode")
+    prefilter: bool = Field(default=False, description="hybrid 模式下以词法候选作为向量检索的预过滤")
+    filter: Optional[str] = Field(default=None, description="元数据过滤表达式，同 RetrieveRequest.filter，作用于每个集合")
+
+class BatchRetrieveRequest(BaseModel):
+    requests: List[RetrieveRequest] = Field(..., description=f"检索请求列表，最多 {MAX_BATCH_REQUESTS} 条，可指向不同集合")
+
+class BatchItemResult(BaseModel):
+    index: int = Field(..., description="对应请求在列表中的位置")
+    status_code: int = Field(..., description="该条请求的处理状态码")
+    response: Optional[RetrieveResponse] = Field(None, description="检索结果，失败时为空")
+    error: Optional[str] = Field(None, description="失败原因")
+
+class BatchRetrieveResponse(BaseModel):
+    results: List[BatchItemResult] = Field(..., description="与请求顺序一致的结果列表")
+    total: int = Field(..., description="请求总数")
 
 # --- 全局变量和初始化 ---
 # 移除全局 index，改为在请求时动态创建
 # index = None
 chroma_client = None
+embed_model = None
+collection_registry = None
+embed_pool = None
+search_pool = None
+embedding_batcher = None
+embedding_cache = None
+version_tracker = None
+result_cache = None
+semantic_cache = None
+
+# 启动状态：当前阶段、是否就绪、失败原因以及各阶段耗时
+startup_state = {
+    "phase": "pending",
+    "ready": False,
+    "error": None,
+    "cuda_available": None,
+    "timings_ms": {},
+    "started_at": time.time()
+}
+
+# --- 运行指标（/metrics）---
+metrics = MetricsRegistry()
+REQUESTS = metrics.counter("kb_requests_total", "检索请求数（按接口、集合与状态码）", ["endpoint", "collection", "status"])
+REQUEST_SECONDS = metrics.histogram("kb_request_duration_seconds", "检索请求整体耗时（秒）", ["endpoint"])
+STAGE_SECONDS = metrics.histogram(
+    "kb_stage_duration_seconds",
+    "检索各阶段耗时（秒）：collection_open / article_lookup / embed / search / postprocess / serialize",
+    ["stage"]
+)
+BATCH_ITEMS = metrics.counter("kb_batch_items_total", "批量检索中各条请求的结果（按集合与状态码）", ["collection", "status"])
+EMBED_BATCH_SIZE = metrics.histogram(
+    "kb_embedding_batch_size", "每次前向计算的查询条数", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+def _cache_counts():
+    """各缓存的 (命中数, 未命中数)"""
+    counts = {}
+    if result_cache is not None:
+        stats = result_cache.stats()
+        counts["result"] = (stats["hits"], stats["misses"])
+    if semantic_cache is not None:
+        stats = semantic_cache.stats()
+        counts["semantic"] = (stats["hits"], stats["misses"])
+    if embedding_cache is not None:
+        stats = embedding_cache.stats()
+        counts["embedding"] = (stats["memory_hits"] + stats["disk_hits"], stats["misses"])
+    return counts
+
+def _pool_stats():
+    return {pool.name: pool.stats() for pool in (embed_pool, search_pool) if pool is not None}
+
+metrics.callback(
+    "kb_cache_hits_total", "缓存命中数", ["cache"],
+    lambda: [((name,), hits) for name, (hits, _) in _cache_counts().items()], kind="counter"
+)
+metrics.callback(
+    "kb_cache_misses_total", "缓存未命中数", ["cache"],
+    lambda: [((name,), misses) for name, (_, misses) in _cache_counts().items()], kind="counter"
+)
+metrics.callback(
+    "kb_cache_hit_ratio", "缓存命中率", ["cache"],
+    lambda: [((name,), hits / (hits + misses) if hits + misses else 0.0) for name, (hits, misses) in _cache_counts().items()]
+)
+metrics.callback(
+    "kb_pool_queued", "工作线程池中排队等待的任务数", ["pool"],
+    lambda: [((name,), stats["queued"]) for name, stats in _pool_stats().items()]
+)
+metrics.callback(
+    "kb_pool_in_flight", "工作线程池中正在执行的任务数", ["pool"],
+    lambda: [((name,), stats["in_flight"]) for name, stats in _pool_stats().items()]
+)
+metrics.callback(
+    "kb_pool_rejected_total", "因排队已满被拒绝的任务数", ["pool"],
+    lambda: [((name,), stats["rejected"]) for name, stats in _pool_stats().items()], kind="counter"
+)
+metrics.callback(
+    "kb_embedding_batcher_pending", "等待凑批的查询数", [],
+    lambda: [((), embedding_batcher.stats()["pending"])] if embedding_batcher is not None else []
+)
+metrics.callback(
+    "process_resident_memory_bytes", "进程常驻内存（字节）", [],
+    lambda: [((), rss) for rss in (process_rss_bytes(),) if rss is not None]
+)
+metrics.callback("kb_ready", "知识库是否已就绪", [], lambda: [((), 1 if startup_state["ready"] else 0)])
+
+# /retrieve 的抽样剖析（PROFILE_SAMPLE_EVERY 为 0 时从不选中）
+profile_sampler = ProfileSampler(PROFILE_SAMPLE_EVERY)
+
+@contextmanager
+def _stage(name: str):
+    """记录一个检索阶段的耗时"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_stage(name, elapsed)
+
+def _tracked(endpoint: str, collection_of: Optional[Callable] = None):
+    """统计接口的请求数（按集合与状态码）与整体耗时
+
+    collection_of 从接口参数中取集合名，经 _collection_label 转为标签；涉及多个集合的接口不传，标签固定为 "*"。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await func(**kwargs)
+                status = response.status_code if isinstance(response, Response) else 200
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            finally:
+                collection = _collection_label(collection_of(kwargs)) if collection_of is not None else "*"
+                REQUESTS.inc(endpoint=endpoint, collection=collection, status=status)
+                REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        return wrapper
+    return decorator
+
+def _collection_label(collection_name: str) -> str:
+    """指标中的集合标签：只使用注册表成功打开过的集合名，拼错或不存在的集合一律记为 unknown，
+    标签取值的数量不受请求内容控制"""
+    if collection_registry is not None and collection_registry.is_known(collection_name):
+        return collection_name
+    return "unknown"
+
+@contextmanager
+def _startup_phase(name: str):
+    """记录启动阶段耗时"""
+    startup_state["phase"] = name
+    started = time.perf_counter()
+    yield
+    elapsed = round((time.perf_counter() - started) * 1000, 1)
+    startup_state["timings_ms"][name] = elapsed
+    logger.info(f"启动阶段 '{name}' 完成，耗时 {elapsed} ms")
+
+def embed_queries(texts: List[str]) -> List[List[float]]:
+    """批量生成查询向量，每 embed_batch_size 条做一次前向计算
+
+    该模型没有 query 前缀，查询向量与文本向量一致，因此直接使用批量文本接口。
+    微批与 /retrieve/batch 的一次请求都不超过 embed_batch_size（见模型初始化），只做一次前向计算；
+    这里按同样的大小显式分块，保证 kb_embedding_batch_size 记录的是每次前向计算的实际条数。
+    """
+    step = embed_model.embed_batch_size
+    vectors = []
+    for start in range(0, len(texts), step):
+        chunk = texts[start:start + step]
+        EMBED_BATCH_SIZE.observe(len(chunk))
+        vectors.extend(embed_model.get_text_embedding_batch(chunk))
+    return vectors
 
 def init_knowledge_base():
     """初始化知识库组件，主要是 embedding 模型和 chroma 客户端"""
-    global chroma_client
+    global chroma_client, embed_model, collection_registry, embed_pool, search_pool, embedding_batcher, embedding_cache
+    global version_tracker, result_cache, semantic_cache
     
     try:
-        logger.info("正在初始化知识库组件...")
+        logger.info(f"正在初始化知识库组件 (启动模式: {STARTUP_MODE})...")
         
         if not Path(CHROMADB_PATH).exists():
             raise FileNotFoundError(f"ChromaDB 路径不存在: {CHROMADB_PATH}")
-        
-        # 1. 显式禁用 LLM 功能，只做检索
-        Settings.llm = MockLLM()
-        Settings.chunk_size = 512
 
-        # 2. 初始化 embedding 模型
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        logger.info(f"使用设备: {device} 加载 Embedding 模型...")
+        # 1. 延迟导入重量级依赖
+        with _startup_phase("imports"):
+            try:
+                from llama_index.core import Settings
+                from llama_index.core.llms import MockLLM # 修正导入路径
+                import chromadb
+                import torch
+            except ImportError as e:
+                logger.error(f"请安装必要的依赖: {e}")
+                logger.error("pip install llama-index chromadb sentence-transformers torch")
+                raise
         
-        embeddings = HuggingFaceEmbedding(model_name=MODEL_PATH, device=device)
-        Settings.embed_model = embeddings
-        logger.info("Embedding 模型加载成功")
+        # 2. 显式禁用 LLM 功能，只做检索；初始化 embedding 模型
+        with _startup_phase("model"):
+            Settings.llm = MockLLM()
+            Settings.chunk_size = 512
+
+            if EMBED_BACKEND not in BACKENDS:
+                raise ValueError(f"未知的 embedding 后端: {EMBED_BACKEND}，可选: {', '.join(BACKENDS)}")
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            startup_state["cuda_available"] = device == 'cuda'
+            logger.info(f"使用设备: {device} 加载 Embedding 模型 (后端: {EMBED_BACKEND})...")
+            
+            # embed_batch_size 不小于微批上限与批量检索的请求数上限，保证一个微批、一次批量检索请求都只做一次前向计算
+            embed_model = create_embed_model(
+                EMBED_BACKEND,
+                MODEL_PATH,
+                device=device,
+                embed_batch_size=max(EMBED_BATCH_MAX_SIZE, MAX_BATCH_REQUESTS, 1),
+                onnx_dir=ONNX_MODEL_DIR,
+                onnx_threads=ONNX_THREADS
+            )
+            Settings.embed_model = embed_model
+            logger.info("Embedding 模型加载成功")
         
         # 3. 初始化 ChromaDB 客户端
-        chroma_client = chromadb.PersistentClient(path=CHROMADB_PATH)
-        
-        logger.info("知识库组件初始化完成")
+        with _startup_phase("chromadb"):
+            if SEARCH_ENGINE not in ENGINES:
+                raise ValueError(f"未知的检索引擎: {SEARCH_ENGINE}，可选: {', '.join(ENGINES)}")
+            chroma_client = chromadb.PersistentClient(path=CHROMADB_PATH)
+            version_tracker = VersionTracker(CHROMADB_PATH, check_interval=VERSION_CHECK_SECONDS)
+            collection_registry = CollectionRegistry(
+                chroma_client,
+                max_size=COLLECTION_CACHE_SIZE,
+                revalidate_seconds=COLLECTION_REVALIDATE_SECONDS,
+                version_of=version_tracker.get,
+                search_engine=SEARCH_ENGINE,
+                exact_max_vectors=EXACT_SEARCH_MAX_VECTORS,
+                exact_dtype=EXACT_SEARCH_DTYPE,
+                snapshot_dir=SNAPSHOT_DIR or None,
+                chroma_path=CHROMADB_PATH,
+                default_threshold=DEFAULT_SIMILARITY_THRESHOLD,
+                auto_threshold=AUTO_THRESHOLD
+            )
+
+        # 4. 初始化工作线程池、查询向量缓存（key 中包含模型标识）与检索结果缓存
+        with _startup_phase("components"):
+            embed_pool = BoundedPool("embed", EMBED_WORKERS, EMBED_QUEUE_SIZE)
+            search_pool = BoundedPool("search", SEARCH_WORKERS, SEARCH_QUEUE_SIZE)
+            embedding_batcher = EmbeddingBatcher(
+                embed_queries,
+                embed_pool,
+                max_batch_size=EMBED_BATCH_MAX_SIZE,
+                max_wait_ms=EMBED_BATCH_MAX_WAIT_MS
+            )
+            embedding_cache = EmbeddingCache(
+                model_id=f"{EMBED_BACKEND}:{MODEL_PATH}",
+                max_bytes=int(EMBED_CACHE_MAX_MB * 1024 * 1024),
+                ttl_seconds=EMBED_CACHE_TTL_SECONDS,
+                disk_path=EMBED_CACHE_DISK_PATH or None,
+                disk_slots=EMBED_CACHE_DISK_SLOTS
+            )
+            result_cache = ResultCache(max_entries=RESULT_CACHE_SIZE, ttl_seconds=RESULT_CACHE_TTL_SECONDS)
+            if SEMANTIC_CACHE_SIZE > 0:
+                semantic_cache = SemanticCache(
+                    max_entries=SEMANTIC_CACHE_SIZE,
+                    max_distance=SEMANTIC_CACHE_MAX_DISTANCE,
+                    ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS
+                )
+
+        # 5. 预热：打开配置的集合，预先计算常见查询的向量
+        if WARMUP_COLLECTIONS or WARMUP_QUERIES:
+            with _startup_phase("warmup"):
+                _warm_up()
+
+        startup_state["phase"] = "ready"
+        startup_state["ready"] = True
+        logger.info(f"知识库组件初始化完成，各阶段耗时(ms): {startup_state['timings_ms']}")
         
     except Exception as e:
+        startup_state["phase"] = "failed"
+        startup_state["error"] = str(e)
         logger.error(f"知识库组件初始化失败: {e}")
         raise
 
+def _warm_up():
+    """打开预热集合的常驻句柄，并把预热查询的向量写入缓存"""
+    names = WARMUP_COLLECTIONS
+    if names == ["all"]:
+        names = [c.name for c in chroma_client.list_collections()]
+    for name in names:
+        try:
+            collection_registry.acquire(name)
+        except Exception as e:
+            logger.warning(f"预热集合 '{name}' 失败: {e}")
+
+    if WARMUP_QUERIES:
+        normalized = list(dict.fromkeys(normalize_query(q) for q in WARMUP_QUERIES))
+        for query, vector in zip(normalized, embed_queries(normalized)):
+            embedding_cache.put(query, vector)
+    logger.info(f"预热完成: {len(names)} 个集合, {len(WARMUP_QUERIES)} 条查询")
+
+def _init_in_background():
+    try:
+        init_knowledge_base()
+    except Exception:
+        # 失败原因已记录在 startup_state 中，由 /ready 返回
+        pass
+
 @app.on_event("startup")
 async def startup_event():
-    """应用启动时初始化知识库"""
-    init_knowledge_base()
+    """应用启动时初始化知识库；background 模式下不阻塞启动，就绪状态由 /ready 报告"""
+    if STARTUP_MODE == "blocking":
+        init_knowledge_base()
+    else:
+        threading.Thread(target=_init_in_background, name="kb-init", daemon=True).start()
+
+def _ensure_ready():
+    """知识库组件尚未就绪时返回 503"""
+    if not startup_state["ready"]:
+        raise HTTPException(
+            status_code=503,
+            detail=f"知识库未初始化 (阶段: {startup_state['phase']})",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时释放工作线程池"""
+    for pool in (embed_pool, search_pool):
+        if pool is not None:
+            pool.shutdown()
+    if embedding_cache is not None:
+        embedding_cache.close()
+
+def _remaining(deadline: float) -> float:
+    """距请求截止时间的剩余秒数"""
+    remaining = deadline - asyncio.get_running_loop().time()
+    if remaining <= 0:
+        raise asyncio.TimeoutError()
+    return remaining
+
+async def _embed_query(query: str, deadline: float) -> List[float]:
+    """获取查询向量：先查向量缓存，未命中再经微批调度计算并回填缓存"""
+    normalized = normalize_query(query)
+    with _stage("embed"):
+        embedding = embedding_cache.get(normalized)
+        if embedding is None:
+            embedding = await embedding_batcher.embed(normalized, timeout=_remaining(deadline))
+            embedding_cache.put(normalized, embedding)
+    return embedding
+
+def _result_cache_key(request: RetrieveRequest) -> tuple:
+    return (
+        request.collection_name,
+        normalize_query(request.query),
+        request.top_k,
+        request.similarity_threshold,
+        request.max_length,
+        request.search_mode,
+        request.prefilter,
+        request.filter
+    )
+
+def _semantic_scope(cache_key: tuple) -> Optional[tuple]:
+    """语义缓存的作用域：结果缓存 key 去掉查询文本，集合与全部检索参数都相同的查询才互相复用。
+
+    语义缓存关闭时，以及条文引用类查询（条号不同的查询向量几乎相同，结果却完全不同）返回 None。
+    """
+    if semantic_cache is None or ARTICLE_PATTERN.search(cache_key[1]):
+        return None
+    return cache_key[:1] + cache_key[2:]
+
+def _request_where(request: Union[RetrieveRequest, MultiRetrieveRequest]) -> Optional[dict]:
+    """把请求中的过滤表达式解析为 Chroma where 条件，格式错误时返回 400"""
+    if not request.filter:
+        return None
+    try:
+        return parse_filter(request.filter)
+    except FilterError as e:
+        raise HTTPException(status_code=400, detail=f"过滤表达式无效: {e}")
+
+def _threshold(handle, request: Union[RetrieveRequest, MultiRetrieveRequest]) -> float:
+    """请求的相似度阈值，未指定时取集合的自适应默认阈值"""
+    if request.similarity_threshold is not None:
+        return request.similarity_threshold
+    return handle.similarity_threshold()
+
+async def _cached_threshold(request: RetrieveRequest, deadline: float) -> Optional[float]:
+    """结果缓存命中时 debug 响应中报告的阈值：请求未指定时取集合句柄上的默认阈值，集合无法打开时为 None"""
+    if request.similarity_threshold is not None:
+        return request.similarity_threshold
+    try:
+        with _stage("collection_open"):
+            handle = await search_pool.run(
+                collection_registry.acquire, request.collection_name, timeout=_remaining(deadline)
+            )
+        return handle.similarity_threshold()
+    except Exception as e:
+        logger.warning(f"读取集合 '{request.collection_name}' 的阈值失败: {e}")
+        return None
+
+def _search_request(handle, request: Union[RetrieveRequest, MultiRetrieveRequest], query_embedding: List[float],
+                    where: Optional[dict] = None, min_score: Optional[float] = None):
+    """按请求的检索模式在集合句柄上检索，返回候选 SearchHit 列表（在检索线程池中执行）
+
+    where 在检索阶段下推执行（Chroma 的 where 子句或精确检索引擎的内存位图），不满足条件的节点不参与打分；
+    min_score 为请求的阈值，在检索结果上做后过滤（不减少检索本身的计算量）。
+    """
+    if request.search_mode == "hybrid":
+        return handle.hybrid_query(
+            request.query, query_embedding, request.top_k, prefilter=request.prefilter, where=where, min_score=min_score
+        )
+    return handle.query([query_embedding], request.top_k, where=where, min_score=min_score)[0]
+
+def _json_response(packed: PackedDocuments, query: str, trace: Optional[RequestTrace] = None) -> Response:
+    """直接返回拼接好的 JSON，不为每条文档构造 Pydantic 模型（response_model 仍用于生成接口文档）
+
+    trace 不为 None 时（debug 请求）附带 timings。
+    """
+    timings = trace.to_dict() if trace is not None else None
+    with _stage("serialize"):
+        return Response(content=response_json(packed, query, timings), media_type="application/json")
+
+def _batch_item(index: int, status_code: int, packed: Optional[PackedDocuments] = None,
+                query: Optional[str] = None, error: Optional[str] = None) -> dict:
+    """与 BatchItemResult 字段一致的 dict"""
+    response = None
+    if packed is not None:
+        response = {"documents": packed.documents, "total": packed.total, "query": query}
+    return {"index": index, "status_code": status_code, "response": response, "error": error}
+
+def _overload_error(e: PoolSaturated) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"服务繁忙，请稍后重试 ({e.pool_name})",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
 
 @app.get("/")
 async def root():
@@ -130,6 +626,24 @@ async def root():
         "version": "1.0.0"
     }
 
+@app.get("/live")
+async def liveness():
+    """存活探针：进程能响应即返回 200，不依赖模型是否加载完成"""
+    return {"status": "alive", "uptime_seconds": round(time.time() - startup_state["started_at"], 1)}
+
+@app.get("/ready")
+async def readiness():
+    """就绪探针：模型与 ChromaDB 初始化完成（含预热）后返回 200"""
+    body = {
+        "ready": startup_state["ready"],
+        "phase": startup_state["phase"],
+        "error": startup_state["error"],
+        "timings_ms": startup_state["timings_ms"]
+    }
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail=body, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    return body
+
 @app.get("/health")
 async def health_check():
     """详细健康检查"""
@@ -137,95 +651,569 @@ async def health_check():
     
     status = {
         "service": "knowledge_api",
-        "status": "healthy" if chroma_client is not None else "unhealthy",
+        "status": "healthy" if startup_state["ready"] else "unhealthy",
         "chromadb_client": "initialized" if chroma_client is not None else "not_initialized",
         "chromadb_path": CHROMADB_PATH,
         "model_path": MODEL_PATH,
-        "cuda_available": torch.cuda.is_available()
+        "embed_backend": EMBED_BACKEND,
+        "cuda_available": startup_state["cuda_available"],
+        "startup": {"phase": startup_state["phase"], "timings_ms": startup_state["timings_ms"]},
+        "collection_registry": collection_registry.stats() if collection_registry is not None else None,
+        "worker_pools": {
+            pool.name: pool.stats() for pool in (embed_pool, search_pool) if pool is not None
+        },
+        "embedding_batcher": embedding_batcher.stats() if embedding_batcher is not None else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+        "result_cache": result_cache.stats() if result_cache is not None else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "collection_versions": version_tracker.snapshot() if version_tracker is not None else None
     }
     
-    if chroma_client is None:
+    if not startup_state["ready"]:
         raise HTTPException(status_code=503, detail="知识库未初始化")
     
     return status
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式的运行指标；启动过程中也可抓取（kb_ready 为 0）"""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.post("/retrieve", response_model=RetrieveResponse)
+@_tracked("retrieve", lambda kwargs: kwargs["request"].collection_name)
 async def retrieve_knowledge(request: RetrieveRequest):
     """检索知识库内容"""
-    global chroma_client
-    
-    if chroma_client is None:
-        raise HTTPException(status_code=503, detail="知识库未初始化 (Chroma Client is None)")
-    
+    _ensure_ready()
+
+    # debug 请求与被抽样剖析的请求才创建 RequestTrace，其余请求不做任何额外记录
+    sampled = profile_sampler.sample()
+    if not (request.debug or sampled):
+        return await _retrieve(request)
+    with tracing(RequestTrace(profile=sampled)) as trace:
+        try:
+            return await _retrieve(request, trace if request.debug else None)
+        finally:
+            if sampled:
+                try:
+                    trace.dump(PROFILE_DIR, request.collection_name)
+                except OSError as e:
+                    logger.warning(f"写入请求剖析结果失败: {e}")
+
+async def _retrieve(request: RetrieveRequest, trace: Optional[RequestTrace] = None) -> Response:
+    """单集合检索；trace 不为 None 时记录阈值与候选数并在响应中附带 timings"""
     try:
         logger.info(f"收到对集合 '{request.collection_name}' 的检索请求: '{request.query}' (top_k={request.top_k})")
         
-        # 动态加载集合并创建索引
+        deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_SECONDS
+        where = _request_where(request)
+
+        # 结果缓存命中时直接返回，跳过 embedding 与向量检索
+        version = version_tracker.get(request.collection_name)
+        cache_key = _result_cache_key(request)
+        cached = result_cache.get(cache_key, version)
+        if cached is not None:
+            logger.info(f"结果缓存命中，返回 {cached.total} 条文档")
+            if trace is not None:
+                trace.cache = "result"
+                trace.threshold = await _cached_threshold(request, deadline)
+                trace.candidates = {"returned": cached.total}
+            return _json_response(cached, request.query, trace)
+
+        # 从注册表获取常驻的集合句柄，未命中时才加载集合并创建索引（Chroma I/O，放入检索线程池）
         try:
-            chroma_collection = chroma_client.get_collection(name=request.collection_name)
-            logger.info(f"成功加载集合: {request.collection_name}")
+            with _stage("collection_open"):
+                handle = await search_pool.run(
+                    collection_registry.acquire, request.collection_name, timeout=_remaining(deadline)
+                )
+        except (PoolSaturated, asyncio.TimeoutError):
+            raise
         except Exception as e:
             logger.error(f"加载集合 '{request.collection_name}' 失败: {e}")
             raise HTTPException(status_code=404, detail=f"知识库集合 '{request.collection_name}' 不存在或加载失败")
 
-        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        index = VectorStoreIndex.from_vector_store(vector_store)
-        
-        # 直接从 index 创建一个配置好 top_k 的 retriever
-        retriever = index.as_retriever(similarity_top_k=request.top_k)
-        
-        # 执行检索
-        nodes = retriever.retrieve(request.query)
+        threshold = _threshold(handle, request)
+        if trace is not None:
+            trace.threshold = threshold
 
-        documents = []
-        total_length = 0
-        if nodes:
-            for node in nodes:
-                score = node.get_score() if hasattr(node, 'get_score') else 0.0
-                
-                # 根据阈值过滤文档
-                if score < request.similarity_threshold:
-                    continue
-
-                content = node.get_content()
-                if total_length + len(content) > request.max_length and len(documents) > 0:
-                    break
-                
-                metadata = node.metadata or {}
-                doc_result = DocumentResult(
-                    content=content,
-                    source=metadata.get('source_file', '未知来源'),
-                    title=metadata.get('full_title', metadata.get('article', '未知标题')),
-                    score=score
+        # "劳动法第六十六条" 这类条文引用直接经条文索引返回，不计算查询向量
+        hits = None
+        if where is None:
+            with _stage("article_lookup"):
+                hits = await search_pool.run(handle.lookup_articles, request.query, request.top_k, timeout=_remaining(deadline))
+            if hits is not None:
+                logger.info(f"条文引用直查命中 {len(hits)} 条")
+
+        # 查询向量优先取自缓存，未命中时经微批调度在 embedding 线程池中计算；
+        # 向量检索在检索线程池中执行，事件循环不被阻塞。
+        # 直接查询 Chroma（而非 llama_index retriever），问答集合命中问题时由句柄换成关联的回答
+        scope = None
+        if hits is None:
+            query_embedding = await _embed_query(request.query, deadline)
+            # 语义缓存：换个说法的同一问题复用已有结果，跳过集合检索
+            scope = _semantic_scope(cache_key)
+            if scope is not None:
+                cached = semantic_cache.get(scope, query_embedding, version)
+                if cached is not None:
+                    logger.info(f"语义缓存命中，返回 {cached.total} 条文档")
+                    result_cache.put(cache_key, version, cached)
+                    if trace is not None:
+                        trace.cache = "semantic"
+                        trace.candidates = {"returned": cached.total}
+                    return _json_response(cached, request.query, trace)
+            # debug 请求不把阈值下推到检索，才能统计阈值过滤前的候选数（返回结果不变）
+            min_score = threshold if trace is None else None
+            with _stage("search"):
+                hits = await search_pool.run(
+                    _search_request, handle, request, query_embedding, where, min_score, timeout=_remaining(deadline)
                 )
-                documents.append(doc_result)
-                total_length += len(content)
-
-        logger.info(f"检索完成，返回 {len(documents)} 条满足阈值 (>{request.similarity_threshold}) 的文档")
-        return RetrieveResponse(
-            documents=documents,
-            total=len(documents),
-            query=request.query
-        )
+
+        # 阈值过滤与 max_length 预算装填，结果（含序列化后的 JSON）写入缓存
+        with _stage("postprocess"):
+            packed = pack_hits(hits, threshold, request.max_length)
+        if trace is not None:
+            trace.candidates = {
+                "retrieved": len(hits),
+                "above_threshold": sum(1 for hit in hits if hit.score >= threshold),
+                "returned": packed.total,
+            }
+
+        logger.info(f"检索完成，返回 {packed.total} 条满足阈值 (>{threshold}) 的文档")
+        result_cache.put(cache_key, version, packed)
+        if scope is not None:
+            semantic_cache.put(scope, query_embedding, version, packed)
+        return _json_response(packed, request.query, trace)
+    except HTTPException:
+        raise
+    except PoolSaturated as e:
+        logger.warning(f"检索请求被拒绝: {e}")
+        raise _overload_error(e)
+    except asyncio.TimeoutError:
+        logger.warning(f"检索超时 (>{REQUEST_TIMEOUT_SECONDS}s): '{request.query}'")
+        raise HTTPException(status_code=504, detail=f"检索超时 (>{REQUEST_TIMEOUT_SECONDS}s)")
     except Exception as e:
         logger.error(f"检索失败: {e}")
         raise HTTPException(status_code=500, detail=f"检索失败: {str(e)}")
 
+async def _search_collection(collection_name: str, items, deadline: float) -> dict:
+    """对同一集合的多条请求做一次向量化查询，返回 {请求位置: PackedDocuments}"""
+    try:
+        with _stage("collection_open"):
+            handle = await search_pool.run(collection_registry.acquire, collection_name, timeout=_remaining(deadline))
+    except (PoolSaturated, asyncio.TimeoutError):
+        raise
+    except Exception as e:
+        logger.error(f"加载集合 '{collection_name}' 失败: {e}")
+        raise HTTPException(status_code=404, detail=f"知识库集合 '{collection_name}' 不存在或加载失败")
+
+    # 不带过滤条件的纯向量请求合并为一次多查询向量的检索，混合检索与带过滤条件的请求逐条执行
+    thresholds = {index: _threshold(handle, request) for index, request, _ in items}
+    batched = [item for item in items if item[1].search_mode == "dense" and not item[1].filter]
+    hits_by_index = {}
+    if batched:
+        n_results = max(request.top_k for _, request, _ in batched)
+        # 合并的查询按其中最低的阈值过滤候选，各请求自己的阈值在装填时再应用
+        min_score = min(thresholds[index] for index, _, _ in batched)
+        with _stage("search"):
+            hits_per_query = await search_pool.run(
+                handle.query, [embedding for _, _, embedding in batched], n_results, None, min_score,
+                timeout=_remaining(deadline)
+            )
+        hits_by_index.update((index, hits) for (index, _, _), hits in zip(batched, hits_per_query))
+    for index, request, embedding in items:
+        if index not in hits_by_index:
+            with _stage("search"):
+                hits_by_index[index] = await search_pool.run(
+                    _search_request, handle, request, embedding, parse_filter(request.filter) if request.filter else None,
+                    thresholds[index], timeout=_remaining(deadline)
+                )
+
+    with _stage("postprocess"):
+        return {
+            index: pack_hits(hits_by_index[index][:request.top_k], thresholds[index], request.max_length)
+            for index, request, _ in items
+        }
+
+async def _lookup_articles(collection_name: str, items, deadline: float) -> dict:
+    """对同一集合的条文引用类请求做条文索引直查，返回 {请求位置: PackedDocuments}，不能直查的请求不在结果中"""
+    with _stage("collection_open"):
+        handle = await search_pool.run(collection_registry.acquire, collection_name, timeout=_remaining(deadline))
+    resolved = {}
+    for index, request in items:
+        with _stage("article_lookup"):
+            hits = await search_pool.run(handle.lookup_articles, request.query, request.top_k, timeout=_remaining(deadline))
+        if hits is not None:
+            with _stage("postprocess"):
+                resolved[index] = pack_hits(hits, _threshold(handle, request), request.max_length)
+    return resolved
+
+def _stream_event(event: dict, fmt: str) -> str:
+    payload = json.dumps(event, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+@app.post("/retrieve/stream")
+@_tracked("stream", lambda kwargs: kwargs["request"].collection_name)
+async def retrieve_knowledge_stream(
+    request: RetrieveRequest,
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$", description="流格式：ndjson 或 sse")
+):
+    """流式检索：先发送带耗时信息的 header 事件，随后逐条发送通过阈值与长度预算的文档，最后发送 summary 事件
+
+    集合加载、embedding 和向量检索在开始推流前完成，这些阶段的错误仍以普通 HTTP 错误返回。
+    """
+    _ensure_ready()
+
+    started = time.perf_counter()
+    timings = {}
+    cached = None
+    scope = None
+    threshold = request.similarity_threshold
+    try:
+        logger.info(f"收到对集合 '{request.collection_name}' 的流式检索请求: '{request.query}' (top_k={request.top_k})")
+        deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_SECONDS
+        where = _request_where(request)
+
+        version = version_tracker.get(request.collection_name)
+        cache_key = _result_cache_key(request)
+        cached = result_cache.get(cache_key, version)
+        if cached is None:
+            try:
+                with _stage("collection_open"):
+                    handle = await search_pool.run(collection_registry.acquire, request.collection_name, timeout=_remaining(deadline))
+            except (PoolSaturated, asyncio.TimeoutError):
+                raise
+            except Exception as e:
+                logger.error(f"加载集合 '{request.collection_name}' 失败: {e}")
+                raise HTTPException(status_code=404, detail=f"知识库集合 '{request.collection_name}' 不存在或加载失败")
+            timings["collection_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            threshold = _threshold(handle, request)
+
+            hits = None
+            if where is None:
+                mark = time.perf_counter()
+                with _stage("article_lookup"):
+                    hits = await search_pool.run(handle.lookup_articles, request.query, request.top_k, timeout=_remaining(deadline))
+                timings["article_lookup_ms"] = round((time.perf_counter() - mark) * 1000, 3)
+
+            if hits is None:
+                mark = time.perf_counter()
+                query_embedding = await _embed_query(request.query, deadline)
+                timings["embed_ms"] = round((time.perf_counter() - mark) * 1000, 3)
+
+                scope = _semantic_scope(cache_key)
+                if scope is not None:
+                    cached = semantic_cache.get(scope, query_embedding, version)
+                if cached is not None:
+                    timings["semantic_cache_hit"] = True
+                    result_cache.put(cache_key, version, cached)
+                else:
+                    mark = time.perf_counter()
+                    with _stage("search"):
+                        hits = await search_pool.run(
+                            _search_request, handle, request, query_embedding, where, threshold, timeout=_remaining(deadline)
+                        )
+                    timings["search_ms"] = round((time.perf_counter() - mark) * 1000, 3)
+            if cached is None:
+                with _stage("postprocess"):
+                    packed = pack_hits(hits, threshold, request.max_length)
+    except HTTPException:
+        raise
+    except PoolSaturated as e:
+        logger.warning(f"流式检索请求被拒绝: {e}")
+        raise _overload_error(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"检索超时 (>{REQUEST_TIMEOUT_SECONDS}s)")
+    except Exception as e:
+        logger.error(f"流式检索失败: {e}")
+        raise HTTPException(status_code=500, detail=f"检索失败: {str(e)}")
+
+    if cached is not None:
+        packed = cached
+
+    async def event_stream():
+        yield _stream_event({
+            "type": "header",
+            "query": request.query,
+            "collection_name": request.collection_name,
+            "top_k": request.top_k,
+            "similarity_threshold": threshold,
+            "cached": cached is not None,
+            "timings": timings
+        }, format)
+
+        total_length = 0
+        for index, document in enumerate(packed.documents):
+            total_length += len(document["content"])
+            yield _stream_event({"type": "document", "index": index, "document": document}, format)
+
+        if cached is None:
+            result_cache.put(cache_key, version, packed)
+            if scope is not None:
+                semantic_cache.put(scope, query_embedding, version, packed)
+        yield _stream_event({
+            "type": "summary",
+            "total": packed.total,
+            "total_length": total_length,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)
+        }, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(event_stream(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+async def _resolve_collections(collection_names, deadline: float) -> List[str]:
+    """把 "all" 展开为全部集合名称，列表去重并保持顺序"""
+    if isinstance(collection_names, str):
+        if collection_names != "all":
+            return [collection_names]
+        collections = await search_pool.run(chroma_client.list_collections, timeout=_remaining(deadline))
+        return sorted(c.name for c in collections)
+    return list(dict.fromkeys(collection_names))
+
+async def _search_one(collection_name: str, request: MultiRetrieveRequest, query_embedding: List[float],
+                      where: Optional[dict], deadline: float):
+    """在单个集合中检索（请求未指定阈值时按该集合的自适应阈值过滤），返回 (SearchHit, 集合名) 列表"""
+    try:
+        with _stage("collection_open"):
+            handle = await search_pool.run(collection_registry.acquire, collection_name, timeout=_remaining(deadline))
+    except (PoolSaturated, asyncio.TimeoutError):
+        raise
+    except Exception as e:
+        logger.error(f"加载集合 '{collection_name}' 失败: {e}")
+        raise HTTPException(status_code=404, detail=f"知识库集合 '{collection_name}' 不存在或加载失败")
+    threshold = _threshold(handle, request)
+    with _stage("search"):
+        hits = await search_pool.run(
+            _search_request, handle, request, query_embedding, where, threshold, timeout=_remaining(deadline)
+        )
+    return [(hit, collection_name) for hit in hits if hit.score >= threshold]
+
+@app.post("/retrieve/multi", response_model=RetrieveResponse)
+@_tracked("multi")
+async def retrieve_knowledge_multi(request: MultiRetrieveRequest):
+    """多集合检索：查询只计算一次向量，并行检索各集合后按分数合并出全局 top_k"""
+    _ensure_ready()
+
+    try:
+        deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_SECONDS
+        where = _request_where(request)
+        names = await _resolve_collections(request.collection_names, deadline)
+        if not names:
+            return _json_response(EMPTY, request.query)
+        logger.info(f"收到多集合检索请求: '{request.query}' -> {names} (top_k={request.top_k})")
+
+        # 版本戳取各集合版本组成的元组，任一集合重新入库都会使缓存失效
+        version = tuple(version_tracker.get(name) for name in names)
+        cache_key = (
+            tuple(names),
+            normalize_query(request.query),
+            request.top_k,
+            request.similarity_threshold,
+            request.max_length,
+            request.search_mode,
+            request.prefilter,
+            request.filter
+        )
+        cached = result_cache.get(cache_key, version)
+        if cached is not None:
+            return _json_response(cached, request.query)
+
+        query_embedding = await _embed_query(request.query, deadline)
+        scope = _semantic_scope(cache_key)
+        if scope is not None:
+            cached = semantic_cache.get(scope, query_embedding, version)
+            if cached is not None:
+                result_cache.put(cache_key, version, cached)
+                return _json_response(cached, request.query)
+        per_collection = await asyncio.gather(
+            *(_search_one(name, request, query_embedding, where, deadline) for name in names)
+        )
+
+        # 堆选出全局 top_k，再统一做阈值过滤与长度预算装填
+        merged = heapq.nlargest(
+            request.top_k,
+            (candidate for candidates in per_collection for candidate in candidates),
+            key=lambda candidate: candidate[0].score
+        )
+        # 各集合的候选已按各自的阈值过滤
+        with _stage("postprocess"):
+            packed = pack_hits(
+                [hit for hit, _ in merged], request.similarity_threshold or 0.0, request.max_length,
+                collections=[name for _, name in merged]
+            )
+
+        logger.info(f"多集合检索完成，{len(names)} 个集合返回 {packed.total} 条文档")
+        result_cache.put(cache_key, version, packed)
+        if scope is not None:
+            semantic_cache.put(scope, query_embedding, version, packed)
+        return _json_response(packed, request.query)
+    except HTTPException:
+        raise
+    except PoolSaturated as e:
+        logger.warning(f"多集合检索请求被拒绝: {e}")
+        raise _overload_error(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"检索超时 (>{REQUEST_TIMEOUT_SECONDS}s)")
+    except Exception as e:
+        logger.error(f"多集合检索失败: {e}")
+        raise HTTPException(status_code=500, detail=f"检索失败: {str(e)}")
+
+@app.post("/retrieve/batch", response_model=BatchRetrieveResponse)
+@_tracked("batch")
+async def retrieve_knowledge_batch(batch: BatchRetrieveRequest):
+    """批量检索：所有查询一次批量 embedding，同一集合的查询合并为一次 Chroma 查询，单条失败不影响其它请求"""
+    _ensure_ready()
+    if not batch.requests or len(batch.requests) > MAX_BATCH_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"批量请求数量必须在 1 到 {MAX_BATCH_REQUESTS} 之间")
+
+    logger.info(f"收到批量检索请求: {len(batch.requests)} 条")
+    deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_SECONDS
+    results = {}
+
+    try:
+        # 1. 过滤表达式无效的请求返回 400，结果缓存命中的请求直接返回
+        pending = []
+        for index, request in enumerate(batch.requests):
+            try:
+                _request_where(request)
+            except HTTPException as e:
+                results[index] = _batch_item(index, e.status_code, error=e.detail)
+                continue
+            version = version_tracker.get(request.collection_name)
+            cached = result_cache.get(_result_cache_key(request), version)
+            if cached is not None:
+                results[index] = _batch_item(index, 200, cached, request.query)
+            else:
+                pending.append((index, request, version))
+
+        # 2. 条文引用直查：与 /retrieve 一致，能经条文索引解析的请求直接返回，不计算查询向量。
+        # 集合加载失败等错误在这里忽略，由第 5 步的检索统一报告
+        citations = {}
+        for index, request, _ in pending:
+            if not request.filter and ARTICLE_PATTERN.search(request.query):
+                citations.setdefault(request.collection_name, []).append((index, request))
+        if citations:
+            outcomes = await asyncio.gather(
+                *(_lookup_articles(name, items, deadline) for name, items in citations.items()),
+                return_exceptions=True
+            )
+            resolved = {}
+            for outcome in outcomes:
+                if not isinstance(outcome, Exception):
+                    resolved.update(outcome)
+            remaining = []
+            for index, request, version in pending:
+                if index in resolved:
+                    result_cache.put(_result_cache_key(request), version, resolved[index])
+                    results[index] = _batch_item(index, 200, resolved[index], request.query)
+                else:
+                    remaining.append((index, request, version))
+            pending = remaining
+
+        # 3. 去重后一次批量计算缓存中没有的查询向量
+        embeddings = {}
+        missing = []
+        for _, request, _ in pending:
+            normalized = normalize_query(request.query)
+            if normalized in embeddings or normalized in missing:
+                continue
+            embedding = embedding_cache.get(normalized)
+            if embedding is None:
+                missing.append(normalized)
+            else:
+                embeddings[normalized] = embedding
+        if missing:
+            with _stage("embed"):
+                vectors = await embed_pool.run(embed_queries, missing, timeout=_remaining(deadline))
+            for normalized, vector in zip(missing, vectors):
+                embedding_cache.put(normalized, vector)
+                embeddings[normalized] = vector
+
+        # 4. 语义缓存命中的请求直接返回
+        remaining = []
+        for index, request, version in pending:
+            scope = _semantic_scope(_result_cache_key(request))
+            cached = semantic_cache.get(scope, embeddings[normalize_query(request.query)], version) if scope else None
+            if cached is not None:
+                result_cache.put(_result_cache_key(request), version, cached)
+                results[index] = _batch_item(index, 200, cached, request.query)
+            else:
+                remaining.append((index, request, version))
+        pending = remaining
+
+        # 5. 按集合分组，各集合并行执行一次多查询向量的检索
+        groups = {}
+        versions = {index: version for index, _, version in pending}
+        for index, request, _ in pending:
+            groups.setdefault(request.collection_name, []).append(
+                (index, request, embeddings[normalize_query(request.query)])
+            )
+        outcomes = await asyncio.gather(
+            *(_search_collection(name, items, deadline) for name, items in groups.items()),
+            return_exceptions=True
+        )
+        for (name, items), outcome in zip(groups.items(), outcomes):
+            if isinstance(outcome, Exception):
+                if isinstance(outcome, HTTPException):
+                    status_code, error = outcome.status_code, outcome.detail
+                elif isinstance(outcome, PoolSaturated):
+                    status_code, error = 503, str(outcome)
+                elif isinstance(outcome, asyncio.TimeoutError):
+                    status_code, error = 504, "检索超时"
+                else:
+                    logger.error(f"批量检索集合 '{name}' 失败: {outcome}")
+                    status_code, error = 500, f"检索失败: {outcome}"
+                results.update((index, _batch_item(index, status_code, error=error)) for index, _, _ in items)
+                continue
+            # 6. 成功的结果写回结果缓存与语义缓存
+            for index, request, embedding in items:
+                packed = outcome[index]
+                result_cache.put(_result_cache_key(request), versions[index], packed)
+                scope = _semantic_scope(_result_cache_key(request))
+                if scope is not None:
+                    semantic_cache.put(scope, embedding, versions[index], packed)
+                results[index] = _batch_item(index, 200, packed, request.query)
+    except PoolSaturated as e:
+        logger.warning(f"批量检索请求被拒绝: {e}")
+        raise _overload_error(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"检索超时 (>{REQUEST_TIMEOUT_SECONDS}s)")
+
+    ordered = [results[index] for index in range(len(batch.requests))]
+    for request, item in zip(batch.requests, ordered):
+        BATCH_ITEMS.inc(collection=_collection_label(request.collection_name), status=item["status_code"])
+    logger.info(f"批量检索完成: {sum(1 for r in ordered if r['status_code'] == 200)}/{len(ordered)} 条成功")
+    # 整个批量响应只序列化一次
+    with _stage("serialize"):
+        content = json.dumps({"results": ordered, "total": len(ordered)}, ensure_ascii=False)
+    return Response(content=content, media_type="application/json")
+
 @app.get("/collections")
 async def list_collections():
     """列出所有可用的集合"""
     global chroma_client
-    if chroma_client is None:
-        raise HTTPException(status_code=503, detail="知识库未初始化 (Chroma Client is None)")
+    _ensure_ready()
         
     try:
-        collections = chroma_client.list_collections()
+        collections = await search_pool.run(chroma_client.list_collections, timeout=REQUEST_TIMEOUT_SECONDS)
         # 将返回的 Collection 对象转换为字典列表
         return [{"name": c.name, "id": str(c.id), "metadata": c.metadata} for c in collections]
+    except PoolSaturated as e:
+        raise _overload_error(e)
     except Exception as e:
         logger.error(f"列出集合失败: {e}")
         raise HTTPException(status_code=500, detail=f"列出集合失败: {str(e)}")
 
+@app.delete("/collections/{collection_name}/cache")
+async def invalidate_collection_cache(collection_name: str):
+    """集合原地重新入库后，手动失效其常驻句柄"""
+    _ensure_ready()
+    removed = collection_registry.invalidate(collection_name)
+    cached_results = result_cache.invalidate_collection(collection_name)
+    if semantic_cache is not None:
+        cached_results += semantic_cache.invalidate_collection(collection_name)
+    return {"collection_name": collection_name, "invalidated": removed, "cached_results": cached_results}
+
 if __name__ == "__main__":
     # 引入 uvicorn 和必要的库
     import uvicorn
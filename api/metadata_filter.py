@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+元数据过滤
+把检索请求中的过滤表达式解析为 Chroma 的 where 条件，例如：
+
+    content_type == 'legal_article'
+    law_name in ['中华人民共和国劳动法', '中华人民共和国治安管理处罚法'] and article != '第一条'
+
+HNSW 引擎直接把 where 下推给 Chroma；精确检索引擎用 MetadataIndex 在内存中按字段建立位图，
+只对满足条件的行计算距离，不匹配的候选从不参与打分。
+"""
+
+import re
+from typing import Any, Dict, List
+
+import numpy as np
+
+# 等值位图缓存的上限（按 (字段, 值) 计），超出时整体清空
+MAX_CACHED_BITMAPS = 1024
+
+_TOKEN = re.compile(
+    r"\s*(?:(?P<string>'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")"
+    r"|(?P<number>-?\d+(?:\.\d+)?)"
+    r"|(?P<op>==|!=|>=|<=|>|<)"
+    r"|(?P<punct>[()\[\],])"
+    r"|(?P<word>[A-Za-z_][A-Za-z0-9_]*))"
+)
+_OPERATORS = {"==": "$eq", "!=": "$ne", ">": "$gt", ">=": "$gte", "<": "$lt", "<=": "$lte"}
+_KEYWORDS = {"and", "or", "in", "not", "true", "false"}
+
+
+class FilterError(ValueError):
+    """过滤表达式无法解析"""
+
+
+def _tokenize(expression: str) -> List[tuple]:
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _TOKEN.match(expression, pos)
+        if match is None or match.end() == pos:
+            raise FilterError(f"过滤表达式在第 {pos + 1} 个字符处无法识别: {expression[pos:pos + 10]!r}")
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "word" and text.lower() in _KEYWORDS:
+            kind, text = "keyword", text.lower()
+        tokens.append((kind, text))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """expr := and_expr ('or' and_expr)*；and_expr := atom ('and' atom)*；
+    atom := '(' expr ')' | 字段 比较符 值 | 字段 ['not'] 'in' '[' 值, ... ']'"""
+
+    def __init__(self, tokens: List[tuple]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (text and token[1] != text):
+            expected = text or kind or "更多内容"
+            raise FilterError(f"过滤表达式格式错误: 期望 {expected}，实际为 {token[1] or '表达式结束'}")
+        self.pos += 1
+        return token
+
+    def parse(self) -> Dict[str, Any]:
+        where = self.expr()
+        if self.pos != len(self.tokens):
+            raise FilterError(f"过滤表达式格式错误: 多余的内容 {self.peek()[1]!r}")
+        return where
+
+    def expr(self):
+        clauses = [self.and_expr()]
+        while self.peek() == ("keyword", "or"):
+            self.take()
+            clauses.append(self.and_expr())
+        return _combine("$or", clauses)
+
+    def and_expr(self):
+        clauses = [self.atom()]
+        while self.peek() == ("keyword", "and"):
+            self.take()
+            clauses.append(self.atom())
+        return _combine("$and", clauses)
+
+    def atom(self):
+        if self.peek() == ("punct", "("):
+            self.take()
+            where = self.expr()
+            self.take("punct", ")")
+            return where
+        field = self.take("word")[1]
+        kind, text = self.peek()
+        if kind == "op":
+            self.take()
+            return {field: {_OPERATORS[text]: self.value()}}
+        negate = False
+        if (kind, text) == ("keyword", "not"):
+            self.take()
+            negate = True
+        self.take("keyword", "in")
+        self.take("punct", "[")
+        values = [self.value()]
+        while self.peek() == ("punct", ","):
+            self.take()
+            values.append(self.value())
+        self.take("punct", "]")
+        return {field: {"$nin" if negate else "$in": values}}
+
+    def value(self):
+        kind, text = self.take()
+        if kind == "string":
+            return re.sub(r"\\(.)", r"\1", text[1:-1])
+        if kind == "number":
+            return float(text) if "." in text else int(text)
+        if kind == "keyword" and text in ("true", "false"):
+            return text == "true"
+        raise FilterError(f"过滤表达式格式错误: {text!r} 不是合法的值（字符串需加引号）")
+
+
+def _combine(operator: str, clauses: List[dict]) -> dict:
+    """合并同类子句，单个子句不再包一层（Chroma 要求 $and/$or 至少两个子句）"""
+    flat = []
+    for clause in clauses:
+        flat.extend(clause[operator] if operator in clause else [clause])
+    return flat[0] if len(flat) == 1 else {operator: flat}
+
+
+def parse_filter(expression: str) -> Dict[str, Any]:
+    """把过滤表达式解析为 Chroma where 条件，格式错误时抛出 FilterError"""
+    tokens = _tokenize(expression)
+    if not tokens:
+        raise FilterError("过滤表达式为空")
+    return _Parser(tokens).parse()
+
+
+class MetadataIndex:
+    """精确检索引擎的内存元数据索引：按需为字段建立列数组，等值条件的位图按 (字段, 值) 缓存"""
+
+    def __init__(self, records):
+        self.ids = []
+        self._metadatas = []
+        for i in range(len(records)):
+            node_id, _, metadata = records[i]
+            self.ids.append(node_id)
+            self._metadatas.append(metadata or {})
+        self._columns: Dict[str, np.ndarray] = {}
+        self._present: Dict[str, np.ndarray] = {}
+        self._bitmaps: Dict[tuple, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def column(self, field: str) -> np.ndarray:
+        column = self._columns.get(field)
+        if column is None:
+            column = np.empty(len(self), dtype=object)
+            column[:] = [metadata.get(field) for metadata in self._metadatas]
+            self._columns[field] = column
+            self._present[field] = np.fromiter((v is not None for v in column), dtype=bool, count=len(self))
+        return column
+
+    def _equals(self, field: str, value) -> np.ndarray:
+        # 布尔值与数值分开比较（Python 中 True == 1），整数与浮点数按数值比较
+        is_bool = isinstance(value, bool)
+        key = (field, is_bool, value)
+        bitmap = self._bitmaps.get(key)
+        if bitmap is None:
+            column = self.column(field)
+            bitmap = np.fromiter(
+                (v == value and isinstance(v, bool) == is_bool for v in column), dtype=bool, count=len(self)
+            )
+            if len(self._bitmaps) >= MAX_CACHED_BITMAPS:
+                self._bitmaps.clear()
+            self._bitmaps[key] = bitmap
+        return bitmap
+
+    def _compare(self, field: str, operator: str, value) -> np.ndarray:
+        if operator == "$eq":
+            return self._equals(field, value)
+        if operator == "$in":
+            return np.logical_or.reduce([self._equals(field, v) for v in value])
+        self.column(field)
+        present = self._present[field]
+        if operator == "$ne":
+            return present & ~self._equals(field, value)
+        if operator == "$nin":
+            return present & ~self._compare(field, "$in", value)
+        compare = {
+            "$gt": lambda v: v > value, "$gte": lambda v: v >= value,
+            "$lt": lambda v: v < value, "$lte": lambda v: v <= value,
+        }.get(operator)
+        if compare is None:
+            raise FilterError(f"不支持的过滤运算符: {operator}")
+        return np.fromiter(
+            (isinstance(v, (int, float)) and not isinstance(v, bool) and compare(v) for v in self.column(field)),
+            dtype=bool, count=len(self)
+        )
+
+    def mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """按 Chroma where 条件求出满足条件的行的布尔掩码"""
+        if "$and" in where:
+            return np.logical_and.reduce([self.mask(clause) for clause in where["$and"]])
+        if "$or" in where:
+            return np.logical_or.reduce([self.mask(clause) for clause in where["$or"]])
+        (field, condition), = where.items()
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        (operator, value), = condition.items()
+        return self._compare(field, operator, value)
+
+    def rows(self, where: Dict[str, Any]) -> np.ndarray:
+        return np.flatnonzero(self.mask(where))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可选的节点文本存储
+入库默认只把正文与元数据写入 Chroma；确实需要按节点 id 取回原文的场景（如离线分析）
+可以额外启用这个 SQLite 存储：按 node_id 主键 O(1) 读写，入库时只写入新增/变更的节点、
+删除已移除的节点，写入开销与变更量成正比，而不是像 docstore.json 那样每次整体重写。
+"""
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+
+class SqliteNodeStore:
+    """(集合, node_id) → (正文, 元数据, 内容哈希) 的键值存储，多个集合可共用一个数据库文件"""
+
+    def __init__(self, path, collection_name: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(path)
+        self.collection_name = collection_name
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            "collection TEXT NOT NULL, node_id TEXT NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL, "
+            "content_hash TEXT, PRIMARY KEY (collection, node_id))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def put_many(self, nodes: Iterable, hash_key: str = "content_hash"):
+        """插入或覆盖一批节点，单个事务提交"""
+        rows = [
+            (self.collection_name, node.node_id, node.text, json.dumps(node.metadata, ensure_ascii=False), node.metadata.get(hash_key))
+            for node in nodes
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO nodes (collection, node_id, text, metadata, content_hash) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def delete_many(self, node_ids: Iterable[str]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM nodes WHERE collection = ? AND node_id = ?",
+                [(self.collection_name, node_id) for node_id in node_ids]
+            )
+
+    def content_hash_of(self, node_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash FROM nodes WHERE collection = ? AND node_id = ?", (self.collection_name, node_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def node_ids(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT node_id FROM nodes WHERE collection = ?", (self.collection_name,))
+            return [row[0] for row in rows]
+
+    def get(self, node_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, metadata, content_hash FROM nodes WHERE collection = ? AND node_id = ?",
+                (self.collection_name, node_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"node_id": node_id, "text": row[0], "metadata": json.loads(row[1]), "content_hash": row[2]}
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM nodes WHERE collection = ?", (self.collection_name,)
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
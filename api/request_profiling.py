@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单请求的耗时分解与抽样性能剖析
+请求带 debug 标记时，检索各阶段的耗时（微秒）与阈值过滤前后的候选数记录到 RequestTrace，随响应返回；
+开启抽样后每 N 个请求对其中一个做 cProfile 剖析：该请求提交到工作线程池的任务各自在线程内剖析，
+请求结束后合并写入本地目录，可用 `python -m pstats` 或 snakeviz 查看（微批 embedding 与同批的其他查询合并计算，
+只有由被剖析请求发起的那一批会出现在结果中）。同一时刻进程内只启用一个剖析器（Python 3.12+ 的 cProfile
+基于进程全局的 sys.monitoring，第二个剖析器无法启用），其他任务照常执行、不计入剖析结果。
+当前请求的 RequestTrace 放在 ContextVar 中，未开启时各阶段只多一次 ContextVar 读取。
+"""
+
+import cProfile
+import itertools
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["RequestTrace"]] = ContextVar("kb_request_trace", default=None)
+# 进程内同一时刻只允许一个任务处于剖析中
+_profiler_lock = threading.Lock()
+
+
+def current_trace() -> Optional["RequestTrace"]:
+    return _current.get()
+
+
+@contextmanager
+def tracing(trace: "RequestTrace"):
+    """在当前上下文中启用 trace，退出时恢复"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+class RequestTrace:
+    """一个请求的阶段耗时、候选数与（抽样时的）cProfile 剖析结果"""
+
+    def __init__(self, profile: bool = False):
+        self.started = time.perf_counter()
+        self.stages_us: Dict[str, int] = {}
+        self.candidates: Dict[str, int] = {}
+        self.cache: Optional[str] = None
+        self.threshold: Optional[float] = None
+        self._profiles = [] if profile else None
+        self._lock = threading.Lock()
+
+    @property
+    def profiling(self) -> bool:
+        return self._profiles is not None
+
+    def add_stage(self, name: str, seconds: float):
+        """同一阶段多次出现时累加"""
+        self.stages_us[name] = self.stages_us.get(name, 0) + int(seconds * 1_000_000)
+
+    def call(self, fn, *args, **kwargs):
+        """在 cProfile 下执行 fn（在工作线程内调用，每次调用单独剖析）
+
+        已有任务在剖析中、或其他剖析工具已启用时，直接执行 fn 而不剖析。
+        """
+        if not _profiler_lock.acquire(blocking=False):
+            return fn(*args, **kwargs)
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+：进程内其他剖析工具（如调试器、外部 profiler）已占用 sys.monitoring
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self._lock:
+                    self._profiles.append(profile)
+        finally:
+            _profiler_lock.release()
+
+    def dump(self, directory, label: str) -> Optional[str]:
+        """合并各次剖析结果写入 directory，返回文件路径；没有剖析结果时返回 None"""
+        with self._lock:
+            profiles = list(self._profiles or ())
+        if not profiles:
+            return None
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        safe_label = "".join(c if c.isalnum() or c in "-_" else "_" for c in label)
+        path = directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_label}-{os.getpid()}-{id(self):x}.prof"
+        pstats.Stats(*profiles).dump_stats(str(path))
+        logger.info(f"请求剖析结果已写入: {path}")
+        return str(path)
+
+    def to_dict(self) -> dict:
+        return {
+            "total_us": int((time.perf_counter() - self.started) * 1_000_000),
+            "stages_us": dict(self.stages_us),
+            "cache": self.cache,
+            "threshold": self.threshold,
+            "candidates": dict(self.candidates),
+        }
+
+
+class ProfileSampler:
+    """每 every_n 个请求选中一个做剖析；every_n 为 0 时关闭"""
+
+    def __init__(self, every_n: int = 0):
+        self.every_n = every_n
+        self._counter = itertools.count(1)
+
+    def sample(self) -> bool:
+        return self.every_n > 0 and next(self._counter) % self.every_n == 0
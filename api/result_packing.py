@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索结果后处理
+直接接收检索得到的正文 / 元数据 / 分数序列：阈值过滤与排序用 numpy 向量化完成，
+max_length 预算按 "分数 / 字符数" 做背包式装填——排名第一的文档总是保留，
+其余文档按单位长度的分数从高到低放入剩余预算，放不下的跳过而不是就此截断，
+较短的低排名文档仍能用上剩余预算。结果直接组装为 dict 并序列化一次，缓存命中时复用序列化结果。
+"""
+
+import json
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+
+class PackedDocuments(NamedTuple):
+    """装填后的文档（与 DocumentResult 字段一致的 dict）及其 JSON 序列化结果"""
+    documents: List[dict]
+    documents_json: str
+
+    @property
+    def total(self) -> int:
+        return len(self.documents)
+
+
+EMPTY = PackedDocuments([], "[]")
+
+
+def select_within_budget(scores: np.ndarray, lengths: np.ndarray, max_length: int) -> np.ndarray:
+    """从已按分数降序排列的候选中选出放入 max_length 预算的下标，结果保持分数降序"""
+    if lengths.sum() <= max_length:
+        return np.arange(len(scores))
+    # 排名第一的文档即使超出预算也保留（与逐条截断时的行为一致），其余按单位长度分数贪心装填
+    chosen = [0]
+    remaining = max_length - int(lengths[0])
+    density = scores[1:] / np.maximum(lengths[1:], 1)
+    for i in np.argsort(-density, kind="stable") + 1:
+        if lengths[i] <= remaining:
+            chosen.append(int(i))
+            remaining -= int(lengths[i])
+    return np.sort(np.asarray(chosen))
+
+
+def pack_documents(
+    contents: Sequence[str],
+    metadatas: Sequence[Optional[dict]],
+    scores: Sequence[float],
+    similarity_threshold: float,
+    max_length: int,
+    collections: Optional[Sequence[Optional[str]]] = None,
+) -> PackedDocuments:
+    """阈值过滤、按分数排序并在 max_length 预算内装填，返回文档 dict 列表及其 JSON"""
+    scores = np.asarray(scores, dtype=np.float64)
+    passed = np.flatnonzero(scores >= similarity_threshold)
+    if not len(passed):
+        return EMPTY
+    ranked = passed[np.argsort(-scores[passed], kind="stable")]
+    lengths = np.fromiter((len(contents[i]) for i in ranked), dtype=np.int64, count=len(ranked))
+    selected = ranked[select_within_budget(scores[ranked], lengths, max_length)]
+
+    documents = []
+    for i in selected:
+        metadata = metadatas[i] or {}
+        documents.append({
+            "content": contents[i],
+            "source": metadata.get("source_file", "未知来源"),
+            "title": metadata.get("full_title", metadata.get("article", "未知标题")),
+            "score": float(scores[i]),
+            "collection": collections[i] if collections is not None else None,
+        })
+    return PackedDocuments(documents, json.dumps(documents, ensure_ascii=False))
+
+
+def pack_hits(hits, similarity_threshold: float, max_length: int,
+              collections: Optional[Sequence[Optional[str]]] = None) -> PackedDocuments:
+    """对 SearchHit 列表做后处理；多集合检索时 collections 给出每条候选所属的集合"""
+    return pack_documents(
+        [hit.content for hit in hits],
+        [hit.metadata for hit in hits],
+        [hit.score for hit in hits],
+        similarity_threshold,
+        max_length,
+        collections
+    )
+
+
+def response_json(packed: PackedDocuments, query: str, timings: Optional[dict] = None) -> str:
+    """拼接 RetrieveResponse 形状的 JSON，文档部分直接复用已序列化的结果；timings 不为 None 时一并附上"""
+    body = f'"documents":{packed.documents_json},"total":{packed.total},"query":{json.dumps(query, ensure_ascii=False)}'
+    if timings is not None:
+        body += f',"timings":{json.dumps(timings, ensure_ascii=False)}'
+    return "{" + body + "}"
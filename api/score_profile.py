@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+集合分数分布画像
+不同集合的向量分布差异很大：法条之间彼此相似，近邻分数普遍偏高；事件、问答集合则更分散，
+同一个全局阈值（0.65）在一个集合上过严、在另一个集合上又放进大量无关文档。
+入库时对集合抽样，统计两类分数的分位数：
+  - 近邻分数：每个样本与其最近邻（排除自身）的分数，近似 "相关" 文档能达到的分数；
+  - 背景分数：样本之间随机成对的分数，近似无关文档的分数。
+二者之间的位置作为该集合的自适应默认阈值，检索时未指定 similarity_threshold 的请求使用它。
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = "kb_profiles"
+# 抽样的向量数：近邻在整个集合中查找，背景分数取样本与另一组随机样本之间的分数
+SAMPLE_SIZE = 256
+# 阈值取背景分数高分位与近邻分数低分位的中点，并限制在合理区间内
+BACKGROUND_QUANTILE = 0.99
+NEIGHBOUR_QUANTILE = 0.10
+MIN_THRESHOLD = 0.3
+MAX_THRESHOLD = 0.9
+# 画像中记录的分位点
+QUANTILES = (0.01, 0.05, 0.10, 0.25, 0.50, 0.75, 0.90, 0.95, 0.99)
+# 少于该数目的样本不足以估计分布，不生成阈值
+MIN_SAMPLES = 8
+
+
+def profile_path(chroma_path, collection_name: str) -> Path:
+    return Path(chroma_path) / PROFILE_DIR / f"{collection_name}.json"
+
+
+def _quantiles(scores: np.ndarray) -> Dict[str, float]:
+    return {f"p{int(round(q * 100)):02d}": round(float(np.quantile(scores, q)), 6) for q in QUANTILES}
+
+
+class ScoreProfile:
+    """单个集合的分数分布画像，附带写入时的集合版本戳与集合 id"""
+
+    def __init__(self, threshold: Optional[float], neighbour: Dict[str, float], background: Dict[str, float],
+                 samples: int = 0, version: int = 0, collection_id: str = ""):
+        self.threshold = threshold
+        self.neighbour = neighbour
+        self.background = background
+        self.samples = samples
+        self.version = version
+        self.collection_id = collection_id
+
+    @classmethod
+    def from_distances(cls, neighbour_distances, background_distances, **kwargs) -> "ScoreProfile":
+        """由近邻距离与背景距离（与 Chroma 同定义）计算画像"""
+        neighbour = np.exp(-np.asarray(neighbour_distances, dtype=np.float64))
+        background = np.exp(-np.asarray(background_distances, dtype=np.float64))
+        if len(neighbour) < MIN_SAMPLES or len(background) < MIN_SAMPLES:
+            return cls(None, {}, {}, samples=len(neighbour), **kwargs)
+        threshold = (np.quantile(background, BACKGROUND_QUANTILE) + np.quantile(neighbour, NEIGHBOUR_QUANTILE)) / 2
+        threshold = round(float(np.clip(threshold, MIN_THRESHOLD, MAX_THRESHOLD)), 4)
+        return cls(threshold, _quantiles(neighbour), _quantiles(background), samples=len(neighbour), **kwargs)
+
+    @classmethod
+    def from_exact_index(cls, index, sample_size: int = SAMPLE_SIZE, seed: int = 0, **kwargs) -> "ScoreProfile":
+        """在精确检索引擎已载入的矩阵上计算：样本对全部行求距离，近邻与背景一次得到"""
+        n = len(index)
+        if n < 2:
+            return cls.from_distances([], [], **kwargs)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+        distances = index.distances(np.asarray(index.matrix[sample], dtype=np.float32))
+        distances[np.arange(len(sample)), sample] = np.inf
+        columns = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+        background = distances[:, columns]
+        return cls.from_distances(distances.min(axis=1), background[np.isfinite(background)], **kwargs)
+
+    @classmethod
+    def from_collection(cls, collection, sample_size: int = SAMPLE_SIZE, seed: int = 0, **kwargs) -> "ScoreProfile":
+        """对 Chroma 集合抽样：近邻由一次多查询向量的 Chroma 检索得到（不读取正文），背景在样本内部计算"""
+        from exact_search import ExactIndex
+
+        kwargs.setdefault("collection_id", str(collection.id))
+        count = collection.count()
+        if count < 2:
+            return cls.from_distances([], [], **kwargs)
+        offset = int(np.random.default_rng(seed).integers(0, max(count - sample_size, 0) + 1))
+        page = collection.get(include=["embeddings"], limit=sample_size, offset=offset)
+        ids, embeddings = page["ids"], page["embeddings"]
+        results = collection.query(query_embeddings=embeddings, n_results=2, include=["distances"])
+        neighbour = []
+        for node_id, result_ids, distances in zip(ids, results["ids"], results["distances"]):
+            others = [d for other, d in zip(result_ids, distances) if other != node_id]
+            if others:
+                neighbour.append(others[0])
+
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        sample = ExactIndex.from_lists(ids, [""] * len(ids), [{}] * len(ids), embeddings, space=space)
+        distances = sample.distances(embeddings)
+        np.fill_diagonal(distances, np.inf)
+        return cls.from_distances(neighbour, distances[np.isfinite(distances)], **kwargs)
+
+    def to_dict(self) -> dict:
+        return {
+            "threshold": self.threshold,
+            "samples": self.samples,
+            "neighbour": self.neighbour,
+            "background": self.background,
+            "version": self.version,
+            "collection_id": self.collection_id,
+        }
+
+    def save(self, path):
+        """写入 JSON；先写临时文件再原子替换"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        logger.info(f"分数画像已写入: 阈值 {self.threshold}, 样本 {self.samples} -> {path}")
+
+    @classmethod
+    def load(cls, path) -> Optional["ScoreProfile"]:
+        """读取 JSON，文件不存在或损坏时返回 None"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(
+                data["threshold"], data["neighbour"], data["background"], samples=data["samples"],
+                version=data["version"], collection_id=data["collection_id"]
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"读取分数画像失败 {path}: {e}")
+            return None
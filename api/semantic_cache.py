@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+语义查询缓存
+用户常常换个说法问同一个问题（"工作时间的规定" 与 "工作时间有什么规定"），按文本精确匹配的结果缓存无法命中。
+本模块把最近查询的向量（归一化后）放在一个定长矩阵中，新查询与同一作用域（集合与检索参数相同）
+内的已缓存查询做一次矩阵-向量乘法，余弦距离不超过 max_distance 时直接复用其检索结果，跳过集合检索。
+条目同样携带集合版本戳，并按 TTL 过期、满时淘汰最久未使用的条目。
+"""
+
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    """按余弦距离匹配查询向量的结果缓存"""
+
+    def __init__(self, max_entries: int = 1024, max_distance: float = 0.05, ttl_seconds: float = 600.0):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self._matrix: Optional[np.ndarray] = None
+        # 各槽位的作用域编号（-1 为空槽）、最近使用时间与过期时间；值与版本戳按槽位存放
+        self._scope_of = np.full(max_entries, -1, dtype=np.int64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._values: List[Any] = [None] * max_entries
+        self._versions: List[Hashable] = [None] * max_entries
+        self._scopes: Dict[Hashable, int] = {}
+        self._scope_keys: List[Hashable] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _scope_id(self, scope: Hashable, create: bool) -> Optional[int]:
+        scope_id = self._scopes.get(scope)
+        if scope_id is None and create:
+            scope_id = len(self._scope_keys)
+            self._scopes[scope] = scope_id
+            self._scope_keys.append(scope)
+        return scope_id
+
+    def _compact_scopes(self):
+        """丢弃已没有条目的作用域并重新编号，作用域数量不超过槽位数"""
+        live = np.unique(self._scope_of[self._scope_of >= 0])
+        remap = np.full(len(self._scope_keys), -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+        self._scope_keys = [self._scope_keys[i] for i in live]
+        self._scopes = {scope: i for i, scope in enumerate(self._scope_keys)}
+        occupied = self._scope_of >= 0
+        self._scope_of[occupied] = remap[self._scope_of[occupied]]
+
+    def _clear_slot(self, slot: int):
+        self._scope_of[slot] = -1
+        self._values[slot] = None
+        self._versions[slot] = None
+
+    def get(self, scope: Hashable, embedding, version: Hashable) -> Optional[Any]:
+        """作用域内与查询向量余弦距离最近且不超过 max_distance、版本一致、未过期的条目的值"""
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            scope_id = self._scope_id(scope, create=False)
+            if scope_id is not None and self._matrix is not None and len(query) == self._matrix.shape[1]:
+                slots = np.flatnonzero(self._scope_of == scope_id)
+                if len(slots):
+                    distances = 1.0 - self._matrix[slots] @ query
+                    for i in np.argsort(distances, kind="stable"):
+                        if distances[i] > self.max_distance:
+                            break
+                        slot = int(slots[i])
+                        if self._versions[slot] != version or self._expires_at[slot] < now:
+                            self._clear_slot(slot)
+                            self.stale += 1
+                            continue
+                        self._last_used[slot] = now
+                        self.hits += 1
+                        return self._values[slot]
+            self.misses += 1
+            return None
+
+    def put(self, scope: Hashable, embedding, version: Hashable, value: Any):
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != len(query):
+                self._matrix = np.zeros((self.max_entries, len(query)), dtype=np.float32)
+                self._scope_of[:] = -1
+            empty = np.flatnonzero(self._scope_of < 0)
+            if len(empty):
+                slot = int(empty[0])
+            else:
+                # 已满时淘汰最久未使用的条目
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            self._clear_slot(slot)
+            if scope not in self._scopes and len(self._scope_keys) >= self.max_entries:
+                self._compact_scopes()
+            self._matrix[slot] = query
+            self._scope_of[slot] = self._scope_id(scope, create=True)
+            self._last_used[slot] = now
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._values[slot] = value
+            self._versions[slot] = version
+
+    def invalidate_collection(self, collection_name: str) -> int:
+        """删除某集合的全部条目（作用域的第一个元素为集合名，多集合检索时为集合名元组）"""
+        with self._lock:
+            scope_ids = [
+                scope_id for scope_id, scope in enumerate(self._scope_keys)
+                if scope[0] == collection_name or (isinstance(scope[0], tuple) and collection_name in scope[0])
+            ]
+            slots = np.flatnonzero(np.isin(self._scope_of, scope_ids))
+            for slot in slots:
+                self._clear_slot(int(slot))
+            return len(slots)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int(np.count_nonzero(self._scope_of >= 0)),
+                "max_entries": self.max_entries,
+                "max_distance": self.max_distance,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
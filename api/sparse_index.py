@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BM25 稀疏词法索引
+中文法条的检索常常取决于条文中的确切术语，而 MiniLM 对这类字面匹配并不敏感。
+本模块按字符二元组（汉字连续片段切成重叠的 2 字词，字母数字串整体作为一个词）建立倒排索引，
+倒排表以 CSR 形式存放在三个连续数组中（indptr / doc_ids / weights），BM25 权重在构建时预先算好，
+查询只需对命中词的倒排表做一次 np.add 累加，可直接用于与稠密检索融合或作为稠密检索的预过滤。
+"""
+
+import logging
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SPARSE_SUFFIX = ".bm25.npz"
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 倒数排名融合的平滑常数
+RRF_K = 60
+# 从 Chroma 分页读取正文时每页的条数
+LOAD_PAGE_SIZE = 2000
+
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+")
+_CJK_START = "\u3400"
+
+
+def sparse_index_path(index_dir, collection_name: str) -> Path:
+    return Path(index_dir) / f"{collection_name}{SPARSE_SUFFIX}"
+
+
+def read_stamp(path) -> Optional[Tuple[int, str]]:
+    """只读取索引文件记录的 (版本戳, 集合 id)，文件不存在或损坏时返回 None"""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            return int(data["version"]), str(data["collection_id"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def tokenize(text: str) -> List[str]:
+    """汉字片段切成重叠的字符二元组（单字片段保留单字），字母数字串小写后整体作为一个词"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if run[0] < _CJK_START or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def index_text(document: str, metadata: Optional[dict]) -> str:
+    """参与词法索引的文本：完整标题（法律名与条号）加正文"""
+    title = (metadata or {}).get("full_title", "")
+    return f"{title}\n{document}" if title else document
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """倒数排名融合：各排名列表中位次为 r 的条目得分 1 / (k + r)，按总分降序返回 (id, 融合分)"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking, 1):
+            fused[node_id] = fused.get(node_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class SparseIndex:
+    """单个集合的 BM25 倒排索引
+
+    词 t 的倒排表为 doc_ids[indptr[t]:indptr[t + 1]]，对应的 weights 即该词对各文档的 BM25 贡献。
+    """
+
+    def __init__(self, terms: Sequence[str], indptr: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray,
+                 ids: Sequence[str], version: int = 0, collection_id: str = ""):
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.ids = list(ids)
+        self.version = version
+        self.collection_id = collection_id
+        self._row_of = None
+
+    @classmethod
+    def build(cls, ids: Sequence[str], texts: Iterable[str], k1: float = BM25_K1, b: float = BM25_B,
+              **kwargs) -> "SparseIndex":
+        vocab: Dict[str, int] = {}
+        term_ids, doc_ids, tfs, lengths = [], [], [], []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(row)
+                tfs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        # 按词排序成 CSR；稳定排序保证同一词的倒排表按文档号递增
+        order = np.argsort(term_ids, kind="stable")
+        docs = np.asarray(doc_ids, dtype=np.int32)[order]
+        tf = np.asarray(tfs, dtype=np.float32)[order]
+        df = np.bincount(term_ids, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        n = len(lengths)
+        lengths = np.asarray(lengths, dtype=np.float32)
+        avgdl = max(float(lengths.mean()), 1.0) if n else 1.0
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths / avgdl)
+        weights = idf[term_ids[order]] * tf * (k1 + 1) / (tf + norm[docs])
+        return cls(list(vocab), indptr, docs, weights.astype(np.float32), ids, **kwargs)
+
+    @classmethod
+    def from_records(cls, records, **kwargs) -> "SparseIndex":
+        """从 (id, 正文, 元数据) 记录表构建，如精确检索引擎已载入的记录"""
+        ids, texts = [], []
+        for i in range(len(records)):
+            node_id, document, metadata = records[i]
+            ids.append(node_id)
+            texts.append(index_text(document, metadata))
+        return cls.build(ids, texts, **kwargs)
+
+    @classmethod
+    def from_collection(cls, collection, **kwargs) -> "SparseIndex":
+        """分页读取 Chroma 集合的正文与元数据构建（不读取向量）"""
+        ids, texts = [], []
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=LOAD_PAGE_SIZE, offset=offset)
+            ids.extend(page["ids"])
+            texts.extend(index_text(d or "", m) for d, m in zip(page["documents"], page["metadatas"]))
+            if len(page["ids"]) < LOAD_PAGE_SIZE:
+                break
+            offset += len(page["ids"])
+        kwargs.setdefault("collection_id", str(collection.id))
+        return cls.build(ids, texts, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.doc_ids.nbytes + self.weights.nbytes
+
+    def mask_for(self, node_ids: Iterable[str]) -> np.ndarray:
+        """给定节点 id 对应行的布尔掩码，不在索引中的 id 被忽略"""
+        if self._row_of is None:
+            self._row_of = {node_id: i for i, node_id in enumerate(self.ids)}
+        mask = np.zeros(len(self), dtype=bool)
+        mask[[self._row_of[node_id] for node_id in node_ids if node_id in self._row_of]] = True
+        return mask
+
+    def scores(self, query: str) -> np.ndarray:
+        """查询对全部文档的 BM25 分数，未命中任何词的文档为 0"""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term, qtf in Counter(tokenize(query)).items():
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            # 同一词的倒排表中文档号互不重复，可直接按下标累加
+            scores[self.doc_ids[start:end]] += qtf * self.weights[start:end]
+        return scores
+
+    def search(self, query: str, n_results: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """返回 BM25 分数最高的至多 n_results 个 (node_id, 分数)，只包含命中了查询词的文档；
+        allowed 为行掩码（如元数据过滤的结果），不在其中的文档不会返回"""
+        scores = self.scores(query)
+        if allowed is not None:
+            scores[~allowed] = 0
+        matched = np.flatnonzero(scores)
+        k = min(n_results, len(matched))
+        if k <= 0:
+            return []
+        if k < len(matched):
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        order = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in order]
+
+    def save(self, path):
+        """写入 .npz；先写临时文件再原子替换"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.array(list(self.vocab), dtype=str),
+                indptr=self.indptr,
+                doc_ids=self.doc_ids,
+                weights=self.weights,
+                ids=np.array(self.ids, dtype=str),
+                version=np.int64(self.version),
+                collection_id=np.array(self.collection_id),
+            )
+        os.replace(tmp_path, path)
+        logger.info(f"稀疏索引已写入: {len(self)} 个文档, {len(self.vocab)} 个词 -> {path}")
+
+    @classmethod
+    def load(cls, path) -> Optional["SparseIndex"]:
+        """读取 .npz，文件不存在或损坏时返回 None"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return cls(
+                    data["terms"].tolist(), data["indptr"], data["doc_ids"], data["weights"], data["ids"].tolist(),
+                    version=int(data["version"]), collection_id=str(data["collection_id"])
+                )
+        except (OSError, ValueError, KeyError):
+            return None
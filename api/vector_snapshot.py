@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+集合向量快照
+把集合的向量、id、正文与元数据导出为一个紧凑的二进制文件，API 以只读 mmap 打开后直接在其上做精确检索：
+多个 uvicorn worker 共享同一份物理页，新 worker 无需从 Chroma 读取向量即可就绪。
+
+文件布局（小端）：
+  头部        magic、格式版本、集合版本戳、向量数、维度、dtype、距离空间及各段偏移
+  info        JSON：集合名、集合 id、导出时间
+  matrix      count × dim 的 float32/float16 矩阵（64 字节对齐；cosine 空间下已按行归一化）
+  offsets     count + 1 个 uint64，记录 i 在 blob 中的区间为 [offsets[i], offsets[i+1])
+  blob        每条记录一个 UTF-8 JSON 数组 [id, 正文, 元数据]，只在命中时解码
+
+导出：python vector_snapshot.py export <ChromaDB 路径> <快照目录> [集合名 ...]
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from exact_search import prepare_matrix, read_collection
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"KBSNAP01"
+FORMAT_VERSION = 1
+SNAPSHOT_SUFFIX = ".kbsnap"
+ALIGNMENT = 64
+
+# magic, 格式版本, 头部长度, 集合版本戳, 向量数, 维度, dtype, 距离空间, info/matrix/offsets/blob 偏移, info 长度
+_HEADER = struct.Struct("<8sIIQQIBBxxQQQQQ")
+
+_DTYPES = {0: np.float32, 1: np.float16}
+_DTYPE_CODES = {"float32": 0, "float16": 1}
+_SPACES = {0: "cosine", 1: "l2", 2: "ip"}
+_SPACE_CODES = {name: code for code, name in _SPACES.items()}
+
+
+def snapshot_path(snapshot_dir, collection_name: str) -> Path:
+    return Path(snapshot_dir) / f"{collection_name}{SNAPSHOT_SUFFIX}"
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def export_collection(collection, path, version: int = 0, dtype: str = "float32") -> dict:
+    """导出集合快照；先写临时文件再原子替换，已映射旧快照的进程不受影响"""
+    started = time.perf_counter()
+    ids, documents, metadatas, embeddings = read_collection(collection)
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    matrix = prepare_matrix(embeddings, len(ids), space, dtype)
+    count, dim = len(ids), (matrix.shape[1] if len(ids) else 0)
+
+    info = json.dumps({
+        "collection": collection.name,
+        "collection_id": str(collection.id),
+        "exported_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }, ensure_ascii=False).encode("utf-8")
+    records = [
+        json.dumps([node_id, document, metadata], ensure_ascii=False).encode("utf-8")
+        for node_id, document, metadata in zip(ids, documents, metadatas)
+    ]
+    offsets = np.zeros(count + 1, dtype="<u8")
+    if records:
+        np.cumsum([len(r) for r in records], out=offsets[1:])
+
+    info_offset = _HEADER.size
+    matrix_offset = _align(info_offset + len(info))
+    offsets_offset = _align(matrix_offset + matrix.nbytes)
+    blob_offset = offsets_offset + offsets.nbytes
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, _HEADER.size, version, count, dim,
+        _DTYPE_CODES[dtype], _SPACE_CODES[space],
+        info_offset, matrix_offset, offsets_offset, blob_offset, len(info)
+    )
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(info)
+        f.write(b"\0" * (matrix_offset - f.tell()))
+        f.write(matrix.astype(_DTYPES[_DTYPE_CODES[dtype]], copy=False).tobytes())
+        f.write(b"\0" * (offsets_offset - f.tell()))
+        f.write(offsets.tobytes())
+        for record in records:
+            f.write(record)
+    os.replace(tmp_path, path)
+
+    stats = {
+        "collection": collection.name,
+        "path": str(path),
+        "version": version,
+        "count": count,
+        "dim": dim,
+        "bytes": path.stat().st_size,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    logger.info(f"集合 '{collection.name}' 快照已导出: {count} 条向量, {stats['bytes']} 字节 -> {path}")
+    return stats
+
+
+def read_header(path) -> Optional[dict]:
+    """只读取快照头部与 info，文件不存在或格式不符时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read(_HEADER.size)
+            if len(raw) < _HEADER.size:
+                return None
+            fields = _HEADER.unpack(raw)
+            if fields[0] != MAGIC or fields[1] != FORMAT_VERSION:
+                return None
+            f.seek(fields[8])
+            info = json.loads(f.read(fields[12]).decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+    (_, _, _, version, count, dim, dtype_code, space_code,
+     info_offset, matrix_offset, offsets_offset, blob_offset, info_len) = fields
+    return dict(
+        info,
+        version=version,
+        count=count,
+        dim=dim,
+        dtype=np.dtype(_DTYPES[dtype_code]).name,
+        space=_SPACES[space_code],
+        matrix_offset=matrix_offset,
+        offsets_offset=offsets_offset,
+        blob_offset=blob_offset,
+    )
+
+
+class VectorSnapshot:
+    """只读 mmap 打开的快照：matrix 是映射内存上的零拷贝视图，记录按行号延迟解码"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        header = read_header(path)
+        if header is None:
+            raise ValueError(f"无效的向量快照文件: {path}")
+        self.header = header
+        self.version = header["version"]
+        self.space = header["space"]
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count, dim = header["count"], header["dim"]
+        self.matrix = np.frombuffer(
+            self._mm, dtype=header["dtype"], count=count * dim, offset=header["matrix_offset"]
+        ).reshape(count, dim)
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=header["offsets_offset"])
+        self._blob_offset = header["blob_offset"]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> Tuple[str, str, dict]:
+        start = self._blob_offset + int(self._offsets[i])
+        end = self._blob_offset + int(self._offsets[i + 1])
+        node_id, document, metadata = json.loads(self._mm[start:end].decode("utf-8"))
+        return node_id, document, metadata
+
+
+def export_all(chroma_path, snapshot_dir, names=None, dtype: str = "float32") -> list:
+    """导出 ChromaDB 中的集合（默认全部）的向量快照与 BM25 稀疏索引，版本戳取自 kb_versions.json"""
+    import chromadb
+    from kb_versions import read_versions
+    from sparse_index import SparseIndex, sparse_index_path
+
+    client = chromadb.PersistentClient(path=str(chroma_path))
+    versions = read_versions(chroma_path)
+    names = names or [c.name for c in client.list_collections()]
+    results = []
+    for name in names:
+        collection = client.get_collection(name=name)
+        version = versions.get(name, {}).get("version", 0)
+        results.append(export_collection(collection, snapshot_path(snapshot_dir, name), version, dtype))
+        SparseIndex.from_collection(collection, version=version).save(sparse_index_path(snapshot_dir, name))
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 4 or sys.argv[1] != "export":
+        print("用法: python vector_snapshot.py export <ChromaDB 路径> <快照目录> [集合名 ...]")
+        sys.exit(1)
+    export_all(sys.argv[2], sys.argv[3], sys.argv[4:], dtype=os.getenv("KB_SNAPSHOT_DTYPE", "float32"))
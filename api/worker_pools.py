@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+有界工作线程池
+把同步的 embedding 计算和 Chroma 查询移出事件循环，并提供排队上限与超时
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from request_profiling import current_trace
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturated(Exception):
+    """线程池排队已满，调用方应返回 503 让客户端稍后重试"""
+
+    def __init__(self, pool_name: str):
+        super().__init__(f"工作线程池 '{pool_name}' 已满")
+        self.pool_name = pool_name
+
+
+class BoundedPool:
+    """最多 max_workers 个任务并发执行、max_queue 个任务排队的线程池
+
+    计数在线程真正结束时才减少：请求超时返回后，仍在执行的任务继续占用名额，
+    这样排队上限反映的是线程池的真实负载。
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"kb-{name}")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    @property
+    def queue_depth(self) -> int:
+        """当前排队（尚未开始执行）的任务数"""
+        with self._lock:
+            return max(0, self._pending - self.max_workers)
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        """在线程池中执行 fn，排队已满抛出 PoolSaturated，超时抛出 asyncio.TimeoutError"""
+        with self._lock:
+            if self._pending >= self.capacity:
+                self.rejected += 1
+                raise PoolSaturated(self.name)
+            self._pending += 1
+
+        call = functools.partial(fn, *args, **kwargs)
+        # 被抽样剖析的请求：任务在工作线程内单独剖析
+        trace = current_trace()
+        if trace is not None and trace.profiling:
+            call = functools.partial(trace.call, call)
+        try:
+            future = self._executor.submit(call)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # 尚未开始的任务直接取消，已在执行的任务只能等它自然结束
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._pending
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": min(pending, self.max_workers),
+                "queued": max(0, pending - self.max_workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        logger.info(f"工作线程池已关闭: {self.name}")
@@ -1,4 +1,3 @@
-import axios from 'axios'
 import { ElMessage } from 'element-plus'
 
 /**
@@ -63,28 +62,22 @@ export class KnowledgeService {
       // 1. 检索知识库 (仅当启用时)
       if (this.settings.useKnowledgeBase.value) {
         onUpdate({ type: 'thinking', content: '正在搜索知识库...' })
-        const knowledgeResult = await this.searchKnowledgeBase(question)
-        
-        if (knowledgeResult.success && knowledgeResult.documents.length > 0) {
+
+        // 流式检索：每收到一条文档就立即渲染，不再等待完整结果
+        let started = false
+        const knowledgeResult = await this.searchKnowledgeBaseStream(question, (doc, index) => {
+          if (!started) {
+            started = true
+            onUpdate({ type: 'answer_start', method: 'knowledge_base' })
+            onUpdate({ type: 'answer', content: this.formatKnowledgeHeader(question) })
+          }
+          onUpdate({ type: 'answer', content: this.formatKnowledgeDocument(doc, index) })
+        })
+
+        if (knowledgeResult.documents.length > 0) {
           // 知识库找到内容
-          onUpdate({ type: 'answer_start', method: 'knowledge_base' })
           onUpdate({ type: 'sources', sources: knowledgeResult.documents.map(d => d.title) })
-          
-          const formattedAnswer = this.formatKnowledgeAnswer(knowledgeResult.documents, question)
-          
-          // 模拟流式输出
-          let currentIndex = 0
-          const streamChunk = () => {
-            if (currentIndex < formattedAnswer.length) {
-              const chunk = formattedAnswer.slice(currentIndex, currentIndex + 15)
-              onUpdate({ type: 'answer', content: chunk })
-              currentIndex += 15
-              setTimeout(streamChunk, 30)
-            } else {
-              onUpdate({ type: 'done' })
-            }
-          }
-          streamChunk()
+          onUpdate({ type: 'done' })
           return // 找到答案，流程结束
         }
       }
@@ -107,21 +100,51 @@ export class KnowledgeService {
   }
 
   /**
-   * 检索知识库
+   * 流式检索知识库（NDJSON），每收到一条文档调用一次 onDocument
    */
-  async searchKnowledgeBase(question) {
+  async searchKnowledgeBaseStream(question, onDocument) {
+    const documents = []
     try {
-      const response = await axios.post(`${this.settings.knowledgeBaseUrl.value}/retrieve`, {
-        query: question,
-        collection_name: this.settings.knowledgeBaseCollection.value, // 传递集合名称
-        top_k: this.settings.searchTopK.value, // 传递 top_k
-        similarity_threshold: 0.65 // 直接使用 0.65 作为阈值
+      const response = await fetch(`${this.settings.knowledgeBaseUrl.value}/retrieve/stream?format=ndjson`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          query: question,
+          collection_name: this.settings.knowledgeBaseCollection.value,
+          top_k: this.settings.searchTopK.value
+        })
       })
-      return { success: true, documents: response.data.documents || [] }
+
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status} ${response.statusText}`)
+      }
+
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop() // 最后一行可能不完整，留到下次拼接
+
+        for (const line of lines) {
+          if (!line.trim()) continue
+          const event = JSON.parse(line)
+          if (event.type === 'document') {
+            documents.push(event.document)
+            onDocument(event.document, event.index)
+          }
+        }
+      }
+      return { success: true, documents }
     } catch (error) {
-      console.error('知识库检索失败:', error)
-      // 检索失败不应中断流程，而是当作没有结果处理
-      return { success: false, documents: [] }
+      console.error('知识库流式检索失败:', error)
+      // 检索失败不应中断流程；已收到的文档仍然有效
+      return { success: false, documents }
     }
   }
 
@@ -269,17 +292,21 @@ export class KnowledgeService {
   }
 
   /**
-   * 格式化知识库答案
+   * 格式化知识库答案的开头
    */
-  formatKnowledgeAnswer(documents, question) {
-    let answer = `【基于知识库】根据您的问题「${question}」，找到以下内容：\n\n`
-    documents.forEach((doc, index) => {
-      answer += `**${index + 1}. ${doc.title}**\n`
-      answer += `> ${doc.content.replace(/\n/g, '\n> ')}\n\n`
-      if (doc.score) {
-        answer += `*(相似度: ${doc.score.toFixed(4)})*\n\n`
-      }
-    })
-    return answer
+  formatKnowledgeHeader(question) {
+    return `【基于知识库】根据您的问题「${question}」，找到以下内容：\n\n`
+  }
+
+  /**
+   * 格式化单条知识库文档
+   */
+  formatKnowledgeDocument(doc, index) {
+    let text = `**${index + 1}. ${doc.title}**\n`
+    text += `> ${doc.content.replace(/\n/g, '\n> ')}\n\n`
+    if (doc.score) {
+      text += `*(相似度: ${doc.score.toFixed(4)})*\n\n`
+    }
+    return text
   }
 }
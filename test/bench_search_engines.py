@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+精确暴力检索与 Chroma HNSW 的对比基准
+对不同规模的合成集合（384 维归一化向量，与 MiniLM 输出一致）测量单查询延迟 p50/p99
+和 HNSW 的 recall@k，给出精确检索不再更快的分界点，用于设置 KB_EXACT_SEARCH_MAX_VECTORS
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import chromadb
+import numpy as np
+
+current_dir = Path(__file__).parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "api"))
+from exact_search import ExactIndex
+
+DIM = 384
+TOP_K = 10
+QUERIES = int(os.getenv("KB_BENCH_QUERIES", "200"))
+SIZES = [int(n) for n in os.getenv("KB_BENCH_SIZES", "300,1000,5000,20000,50000,100000").split(",")]
+ADD_BATCH = 5000
+
+
+def random_unit_vectors(rng, n):
+    vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentiles_ms(samples):
+    samples = np.asarray(samples) * 1000
+    return np.percentile(samples, 50), np.percentile(samples, 99)
+
+
+def time_queries(search, queries):
+    samples = []
+    for q in queries:
+        started = time.perf_counter()
+        search(q)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_size(client, rng, n):
+    vectors = random_unit_vectors(rng, n)
+    # 查询取自库内向量加噪声，使近邻结构接近真实检索
+    queries = vectors[rng.integers(0, n, QUERIES)] + 0.3 * random_unit_vectors(rng, QUERIES)
+    ids = [f"v{i}" for i in range(n)]
+
+    collection = client.create_collection(name=f"bench_{n}", metadata={"hnsw:space": "cosine"})
+    for start in range(0, n, ADD_BATCH):
+        collection.add(ids=ids[start:start + ADD_BATCH], embeddings=vectors[start:start + ADD_BATCH].tolist())
+
+    exact32 = ExactIndex.from_lists(ids, [""] * n, [{}] * n, vectors, space="cosine")
+    exact16 = ExactIndex.from_lists(ids, [""] * n, [{}] * n, vectors, space="cosine", dtype="float16")
+
+    hnsw_ids = []
+
+    def hnsw_search(q):
+        result = collection.query(query_embeddings=[q.tolist()], n_results=TOP_K, include=["distances"])
+        hnsw_ids.append(result["ids"][0])
+
+    exact_ids = []
+
+    def exact_search(q):
+        exact_ids.append([hit.node_id for hit in exact32.search([q], TOP_K)[0]])
+
+    hnsw = percentiles_ms(time_queries(hnsw_search, queries))
+    exact = percentiles_ms(time_queries(exact_search, queries))
+    half = percentiles_ms(time_queries(lambda q: exact16.search([q], TOP_K), queries))
+    recall = np.mean([len(set(h) & set(e)) / TOP_K for h, e in zip(hnsw_ids, exact_ids)])
+    client.delete_collection(name=f"bench_{n}")
+    return hnsw, exact, half, recall
+
+
+def main():
+    rng = np.random.default_rng(42)
+    path = tempfile.mkdtemp(prefix="kb_bench_")
+    try:
+        client = chromadb.PersistentClient(path=path)
+        print(f"维度 {DIM}, top_k {TOP_K}, 每种规模 {QUERIES} 条查询，延迟单位 ms (p50 / p99)")
+        print(f"{'向量数':>8} | {'HNSW':>15} | {'exact f32':>15} | {'exact f16':>15} | HNSW recall@{TOP_K}")
+        crossover = None
+        for n in SIZES:
+            hnsw, exact, half, recall = bench_size(client, rng, n)
+            print(f"{n:>8} | {hnsw[0]:6.3f} / {hnsw[1]:6.3f} | {exact[0]:6.3f} / {exact[1]:6.3f} | "
+                  f"{half[0]:6.3f} / {half[1]:6.3f} | {recall:.3f}")
+            if crossover is None and exact[0] > hnsw[0]:
+                crossover = n
+        if crossover is None:
+            print(f"测试范围内精确检索始终不慢于 HNSW，可将 KB_EXACT_SEARCH_MAX_VECTORS 设为 {SIZES[-1]} 或更大")
+        else:
+            print(f"分界点约在 {crossover} 条向量：超过该规模时 HNSW 更快，建议 KB_EXACT_SEARCH_MAX_VECTORS 设在其下方")
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
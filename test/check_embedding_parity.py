@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对比 onnx-int8 与 torch 两种 embedding 后端的一致性
+在内置的法条语料上计算逐条余弦漂移、检索排序一致率和 0.65 阈值判定的翻转数，并给出吞吐
+"""
+
+import json
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+current_dir = Path(__file__).parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "api"))
+from embedding_backends import BACKEND_ONNX_INT8, BACKEND_TORCH, create_embed_model
+
+DATA_PATH = current_dir / "data"
+MODEL_PATH = r'D:\llama index\sentence-transformers\paraphrase-multilingual-MiniLM-L12-v2'
+if not Path(MODEL_PATH).exists():
+    MODEL_PATH = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+ONNX_MODEL_DIR = os.getenv("KB_ONNX_MODEL_DIR", str(project_root / "models" / "minilm-onnx-int8"))
+
+# 低于该余弦相似度的条目视为漂移过大，脚本以非零状态退出
+MIN_COSINE = float(os.getenv("KB_PARITY_MIN_COSINE", "0.98"))
+SIMILARITY_THRESHOLD = 0.65
+TOP_K = 5
+BATCH_SIZE = 32
+
+TEST_QUERIES = [
+    "工作时间的规定",
+    "劳动合同终止的条件",
+    "试用期最长多久",
+    "煽动、策划非法集会、游行、示威，不听劝阻的处理？",
+    "非法集会游行示威",
+    "学医的怎么规划自己学习",
+    "如何做好吃的火锅",
+]
+
+
+def load_corpus():
+    """读取 test/data 下所有 {标题: 正文} 格式的 JSON"""
+    titles, texts = [], []
+    for file in sorted(DATA_PATH.glob('*.json')):
+        with open(file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            continue
+        for key, value in data.items():
+            if isinstance(value, str) and value.strip():
+                titles.append(key)
+                texts.append(value)
+    return titles, texts
+
+
+def embed_all(model, texts):
+    vectors = []
+    started = time.perf_counter()
+    for i in range(0, len(texts), BATCH_SIZE):
+        vectors.extend(model.get_text_embedding_batch(texts[i:i + BATCH_SIZE]))
+    elapsed = time.perf_counter() - started
+    return np.asarray(vectors, dtype=np.float32), elapsed
+
+
+def to_score(cosine):
+    """与 ChromaVectorStore 一致的相似度换算（余弦距离 → exp(-distance)）"""
+    return math.exp(-(1.0 - cosine))
+
+
+def check_parity():
+    titles, texts = load_corpus()
+    print(f"语料: {len(texts)} 条，查询: {len(TEST_QUERIES)} 条")
+
+    torch_model = create_embed_model(BACKEND_TORCH, MODEL_PATH, device='cpu', embed_batch_size=BATCH_SIZE)
+    onnx_model = create_embed_model(BACKEND_ONNX_INT8, MODEL_PATH, embed_batch_size=BATCH_SIZE, onnx_dir=ONNX_MODEL_DIR)
+
+    torch_docs, torch_seconds = embed_all(torch_model, texts)
+    onnx_docs, onnx_seconds = embed_all(onnx_model, texts)
+    print(f"吞吐: torch {len(texts) / torch_seconds:.1f} docs/s, onnx-int8 {len(texts) / onnx_seconds:.1f} docs/s "
+          f"(加速 {torch_seconds / onnx_seconds:.2f}x)")
+
+    # 1. 逐条文档向量的余弦漂移（两种后端输出均已归一化）
+    cosines = np.sum(torch_docs * onnx_docs, axis=1)
+    print(f"文档向量余弦: mean={cosines.mean():.5f} p1={np.percentile(cosines, 1):.5f} min={cosines.min():.5f}")
+    worst = np.argsort(cosines)[:3]
+    for i in worst:
+        print(f"  漂移最大: {titles[i]} cos={cosines[i]:.5f}")
+
+    # 2. 查询的 top-k 排序一致率与阈值判定翻转
+    torch_queries, _ = embed_all(torch_model, TEST_QUERIES)
+    onnx_queries, _ = embed_all(onnx_model, TEST_QUERIES)
+    overlap_total = 0
+    top1_agree = 0
+    flips = 0
+    for qi, query in enumerate(TEST_QUERIES):
+        torch_sims = torch_docs @ torch_queries[qi]
+        onnx_sims = onnx_docs @ onnx_queries[qi]
+        torch_top = list(np.argsort(-torch_sims)[:TOP_K])
+        onnx_top = list(np.argsort(-onnx_sims)[:TOP_K])
+        overlap = len(set(torch_top) & set(onnx_top))
+        overlap_total += overlap
+        top1_agree += int(torch_top[0] == onnx_top[0])
+        for i in set(torch_top) | set(onnx_top):
+            if (to_score(torch_sims[i]) >= SIMILARITY_THRESHOLD) != (to_score(onnx_sims[i]) >= SIMILARITY_THRESHOLD):
+                flips += 1
+        print(f"  '{query}': top{TOP_K} 重合 {overlap}/{TOP_K}, top1 {'一致' if torch_top[0] == onnx_top[0] else '不一致'}")
+    print(f"top{TOP_K} 平均重合率: {overlap_total / (TOP_K * len(TEST_QUERIES)):.2%}, "
+          f"top1 一致: {top1_agree}/{len(TEST_QUERIES)}, 阈值 {SIMILARITY_THRESHOLD} 判定翻转: {flips}")
+
+    passed = cosines.min() >= MIN_COSINE
+    print(f"结论: {'通过' if passed else '未通过'} (最小余弦 {cosines.min():.5f}, 要求 >= {MIN_COSINE})")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_parity() else 1)
@@ -1,69 +1,46 @@
 from pathlib import Path
-from llama_index.core.schema import TextNode
-import json
 import chromadb
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.core import VectorStoreIndex, StorageContext, Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core import Settings
+import logging
+import os
+import sys
+sys.path.append(str(Path(__file__).parent.parent / "api"))
+from embedding_backends import create_embed_model
+from ingestion import CONTENT_TYPE_LEGAL_ARTICLE, embed_spec_for, ingest_files
+from node_store import SqliteNodeStore
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 DATA_DIR = r'D:\llama index\test\data'
 CHROMADB_PATH = r'D:\llama index\test\chroma'
 COLLECTION_NAME = 'laodongfa'
-PERSIST_DIR = r'D:\llama index\test\persist'
 MODEL_PATH = r'D:\llama index\sentence-transformers\paraphrase-multilingual-MiniLM-L12-v2'
+# embedding 后端：torch 或 onnx-int8，需与检索 API 使用的后端一致
+EMBED_BACKEND = os.getenv("KB_EMBED_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("KB_ONNX_MODEL_DIR", str(Path(__file__).parent.parent / "models" / "minilm-onnx-int8"))
+# 并行 embedding 的进程数，0 或 1 表示在当前进程中串行
+INGEST_WORKERS = int(os.getenv("KB_INGEST_WORKERS", "0"))
+EMBED_SPEC = embed_spec_for(EMBED_BACKEND, MODEL_PATH, INGEST_WORKERS, onnx_dir=ONNX_MODEL_DIR)
+# 可选的 SQLite 节点文本存储路径，为空时正文与元数据只存于 Chroma
+NODE_STORE_PATH = os.getenv("KB_NODE_STORE_PATH", "")
 
 def init_model():
-    embeddings = HuggingFaceEmbedding(model_name=MODEL_PATH)
+    embeddings = create_embed_model(**EMBED_SPEC)
     Settings.embed_model = embeddings
-def load_data (path):
-    files = list(Path(path).glob('*.json'))
-    all_data = []
-    for file in files:
-        with open(file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            all_data.append({
-                'content': data,
-                'metadata': { 'source': file.name }
-            })
-    return all_data
-def create_nodes(all_data):
-    nodes = []
-    for file in all_data:
-        law_dict = file["content"]
-        source_file = file["metadata"]["source"]
-        for key, value in law_dict.items():
-            node_id = f"{source_file}_{key}"
-            parts = key.split(' ', 1)
-            law_name = parts[0] if len(parts) > 0 else "未知法律"
-            article = parts[1] if len(parts) > 1 else "未知条款"
-            node = TextNode(
-                id=node_id,
-                text=value,
-                metadata={
-                    "law_name": law_name,
-                    "article": article,
-                    "full_title": key,
-                    "source_file": source_file,
-                    "content_type": "legal_article"
-                }
-            )
-            nodes.append(node)
-    return nodes
-def save(nodes):
+def save(paths):
     client = chromadb.PersistentClient(CHROMADB_PATH)
-    collection = client.get_or_create_collection(name=COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
-    storage_context = StorageContext.from_defaults(
-        vector_store=ChromaVectorStore(chroma_collection=collection)
+    node_store = SqliteNodeStore(NODE_STORE_PATH, COLLECTION_NAME) if NODE_STORE_PATH else None
+    # 增量入库：只对新增/变更的法条做 embedding，删除已移除的法条，有写入时更新版本戳
+    ingest_files(
+        client,
+        COLLECTION_NAME,
+        paths,
+        content_type=CONTENT_TYPE_LEGAL_ARTICLE,
+        chroma_path=CHROMADB_PATH,
+        node_store=node_store,
+        workers=INGEST_WORKERS,
+        embed_spec=EMBED_SPEC
     )
-    storage_context.docstore.add_documents(nodes)
-    index = VectorStoreIndex(
-        nodes,
-        storage_context=storage_context,
-        show_progress=True
-    )
-    storage_context.persist(PERSIST_DIR)
-    index.storage_context.persist(PERSIST_DIR)
 if __name__ == '__main__':
-    init_model()
-    all_data = load_data(DATA_DIR)
-    nodes = create_nodes(all_data)
-    save(nodes)
\ No newline at end of file
+    # 并行模式下模型在各工作进程中加载
+    if INGEST_WORKERS <= 1:
+        init_model()
+    save(sorted(Path(DATA_DIR).glob('*.json')))
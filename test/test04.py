@@ -1,11 +1,9 @@
 from pathlib import Path
-from llama_index.core.schema import TextNode
-import json
 import chromadb
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.core import VectorStoreIndex, StorageContext, Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core import Settings
 import logging
+import os
+import sys
 
 # --- 配置 ---
 # 日志配置
@@ -19,6 +17,17 @@ DATA_PATH = str(project_root / "test" / "data")
 CHROMADB_PATH = str(project_root / "test" / "chroma")
 MODEL_PATH = r'D:\llama index\sentence-transformers\paraphrase-multilingual-MiniLM-L12-v2'
 
+sys.path.append(str(project_root / "api"))
+from embedding_backends import create_embed_model
+from ingestion import CONTENT_TYPE_HISTORICAL_EVENT, embed_spec_for, ingest_files
+
+# embedding 后端：torch 或 onnx-int8，需与检索 API 使用的后端一致
+EMBED_BACKEND = os.getenv("KB_EMBED_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("KB_ONNX_MODEL_DIR", str(project_root / "models" / "minilm-onnx-int8"))
+# 并行 embedding 的进程数，0 或 1 表示在当前进程中串行
+INGEST_WORKERS = int(os.getenv("KB_INGEST_WORKERS", "0"))
+EMBED_SPEC = embed_spec_for(EMBED_BACKEND, MODEL_PATH, INGEST_WORKERS, device='cuda', onnx_dir=ONNX_MODEL_DIR)
+
 # 新集合的名称
 COLLECTION_NAME = 'jinxiandaishi_events'
 # 要处理的特定JSON文件名
@@ -27,108 +36,23 @@ DATA_FILE_NAME = 'jinxiandaishi_event.json'
 
 def init_model():
     """初始化 Embedding 模型"""
-    logger.info(f"正在从 '{MODEL_PATH}' 加载模型...")
-    # 使用 HuggingFaceEmbedding 并设置到全局 Settings
-    embeddings = HuggingFaceEmbedding(model_name=MODEL_PATH, device='cuda')
+    logger.info(f"正在从 '{MODEL_PATH}' 加载模型 (后端: {EMBED_BACKEND})...")
+    # 按配置的后端创建 embedding 模型并设置到全局 Settings
+    embeddings = create_embed_model(**EMBED_SPEC)
     Settings.embed_model = embeddings
     logger.info("模型加载完成。")
 
-def load_data(path, filename):
-    """加载指定的 JSON 数据文件"""
-    file_path = Path(path) / filename
+if __name__ == '__main__':
+    file_path = Path(DATA_PATH) / DATA_FILE_NAME
     if not file_path.exists():
         logger.error(f"数据文件未找到: {file_path}")
-        return None
-    
-    logger.info(f"正在从 '{file_path}' 加载数据...")
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # 保持与 test01.py 一致的数据结构
-    return {
-        'content': data,
-        'metadata': { 'source': file_path.name }
-    }
+        sys.exit(1)
 
-def create_nodes(data):
-    """根据加载的数据创建 TextNode 列表"""
-    if not data:
-        return []
-    
-    nodes = []
-    history_dict = data["content"]
-    source_file = data["metadata"]["source"]
-    
-    logger.info(f"正在为 '{source_file}' 中的 {len(history_dict)} 个事件创建节点...")
-    
-    for event_title, event_description in history_dict.items():
-        # 创建唯一的节点ID
-        node_id = f"{source_file}_{event_title.replace(' ', '_')}"
-        
-        # 创建 TextNode 对象
-        node = TextNode(
-            id_=node_id,
-            text=event_description,
-            metadata={
-                "event_title": event_title,
-                "full_title": event_title, # 保持字段一致性
-                "source_file": source_file,
-                "content_type": "historical_event" # 定义新的内容类型
-            }
-        )
-        nodes.append(node)
-        
-    logger.info(f"成功创建 {len(nodes)} 个节点。")
-    return nodes
+    # 1. 初始化模型（并行模式下模型在各工作进程中加载）
+    if INGEST_WORKERS <= 1:
+        init_model()
 
-def save_to_chroma(nodes, collection_name):
-    """将节点保存到 ChromaDB，严格遵循 test01.py 的方法"""
-    if not nodes:
-        logger.warning("没有可保存的节点，操作已跳过。")
-        return
-
-    logger.info(f"正在连接到 ChromaDB: {CHROMADB_PATH}")
+    # 2. 增量同步到 ChromaDB：只对新增/变更的事件做 embedding，删除已移除的事件
     client = chromadb.PersistentClient(path=CHROMADB_PATH)
-    
-    logger.info(f"正在获取或创建集合: '{collection_name}' (使用余弦距离)")
-    # 关键步骤：使用 get_or_create_collection 并指定余弦距离
-    collection = client.get_or_create_collection(
-        name=collection_name, 
-        metadata={"hnsw:space": "cosine"}
-    )
-    
-    # 创建向量存储
-    vector_store = ChromaVectorStore(chroma_collection=collection)
-    
-    # 创建并配置存储上下文
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    
-    # 关键步骤：先将文档添加到 docstore
-    logger.info("正在将文档添加到 docstore...")
-    storage_context.docstore.add_documents(nodes)
-    
-    # 创建索引
-    logger.info("正在构建向量索引...")
-    index = VectorStoreIndex(
-        nodes,
-        storage_context=storage_context,
-        show_progress=True
-    )
-    
-    logger.info(f"✅ 集合 '{collection_name}' 已成功创建并填充了 {len(nodes)} 个文档。")
-
-if __name__ == '__main__':
-    # 1. 初始化模型
-    init_model()
-    
-    # 2. 加载数据
-    history_data = load_data(DATA_PATH, DATA_FILE_NAME)
-    
-    # 3. 创建节点
-    if history_data:
-        nodes = create_nodes(history_data)
-        
-        # 4. 保存到 ChromaDB
-        save_to_chroma(nodes, COLLECTION_NAME)
-    else:
-        logger.error("未能加载数据，程序已退出。")
\ No newline at end of file
+    ingest_files(client, COLLECTION_NAME, [file_path], content_type=CONTENT_TYPE_HISTORICAL_EVENT, chroma_path=CHROMADB_PATH,
+                 workers=INGEST_WORKERS, embed_spec=EMBED_SPEC)
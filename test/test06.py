@@ -0,0 +1,63 @@
+from pathlib import Path
+import chromadb
+from llama_index.core import Settings
+import torch
+import logging
+import os
+import sys
+
+# --- 配置 ---
+# 日志配置
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# 路径配置 (与 test01.py 保持一致的结构)
+current_dir = Path(__file__).parent
+project_root = current_dir.parent
+DATA_PATH = str(project_root)
+CHROMADB_PATH = str(project_root / "test" / "chroma")
+MODEL_PATH = r'D:\llama index\sentence-transformers\paraphrase-multilingual-MiniLM-L12-v2'
+
+sys.path.append(str(project_root / "api"))
+from embedding_backends import create_embed_model
+from ingestion import CONTENT_TYPE_QA, embed_spec_for, ingest_files
+
+# embedding 后端：torch 或 onnx-int8，需与检索 API 使用的后端一致
+EMBED_BACKEND = os.getenv("KB_EMBED_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("KB_ONNX_MODEL_DIR", str(project_root / "models" / "minilm-onnx-int8"))
+# 并行 embedding 的进程数，0 或 1 表示在当前进程中串行
+INGEST_WORKERS = int(os.getenv("KB_INGEST_WORKERS", "0"))
+EMBED_SPEC = embed_spec_for(
+    EMBED_BACKEND, MODEL_PATH, INGEST_WORKERS,
+    device='cuda' if torch.cuda.is_available() else 'cpu', onnx_dir=ONNX_MODEL_DIR
+)
+
+# 新集合的名称
+COLLECTION_NAME = 'fintech_qa'
+# 要处理的特定JSON文件名
+DATA_FILE_NAME = 'fintech.json'
+
+
+def init_model():
+    """初始化 Embedding 模型"""
+    logger.info(f"正在从 '{MODEL_PATH}' 加载模型 (后端: {EMBED_BACKEND})...")
+    # 按配置的后端创建 embedding 模型并设置到全局 Settings
+    embeddings = create_embed_model(**EMBED_SPEC)
+    Settings.embed_model = embeddings
+    logger.info("模型加载完成。")
+
+if __name__ == '__main__':
+    file_path = Path(DATA_PATH) / DATA_FILE_NAME
+    if not file_path.exists():
+        logger.error(f"数据文件未找到: {file_path}")
+        sys.exit(1)
+
+    # 1. 初始化模型（并行模式下模型在各工作进程中加载）
+    if INGEST_WORKERS <= 1:
+        init_model()
+
+    # 2. 增量同步到 ChromaDB：问题与回答分别建索引（history 中的每轮问答作为额外入口），
+    #    只对新增/变更的问答做 embedding，删除已移除的问答
+    client = chromadb.PersistentClient(path=CHROMADB_PATH)
+    ingest_files(client, COLLECTION_NAME, [file_path], content_type=CONTENT_TYPE_QA, chroma_path=CHROMADB_PATH,
+                 workers=INGEST_WORKERS, embed_spec=EMBED_SPEC)
@@ -1,14 +1,12 @@
-# 严格按照 test01.py 老方法实现的最终版
+# 按数据文件分别入库：每个 JSON 文件同步到各自的集合（增量，加 --rebuild 参数时全量重建）
 import os
-import json
+import re
 from pathlib import Path
 import logging
 import chromadb
-from llama_index.core.schema import TextNode
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.core import VectorStoreIndex, StorageContext, Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core import Settings
 import torch
+import sys
 
 # 日志配置
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -21,105 +19,67 @@ CHROMADB_PATH = str(project_root / "test" / "chroma")
 DATA_PATH = str(project_root / "test" / "data")
 MODEL_PATH = r'D:\llama index\sentence-transformers\paraphrase-multilingual-MiniLM-L12-v2'
 
-def init_model():
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    logger.info(f"使用设备: {device} 加载 Embedding 模型...")
-    Settings.embed_model = HuggingFaceEmbedding(model_name=MODEL_PATH, device=device)
-    os.makedirs(CHROMADB_PATH, exist_ok=True)
-    db = chromadb.PersistentClient(path=CHROMADB_PATH)
-    return db
-
-def load_data(data_path):
-    files = list(Path(data_path).glob('*.json'))
-    all_data = []
-    for file in files:
-        try:
-            with open(file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                all_data.append({
-                    'content': data,
-                    'metadata': {'source': file.name, 'stem': file.stem}
-                })
-        except Exception as e:
-            logger.warning(f"加载文件 {file} 失败: {e}")
-    return all_data
+sys.path.append(str(project_root / "api"))
+from embedding_backends import create_embed_model
+from ingestion import CONTENT_TYPE_LEGAL_ARTICLE, embed_spec_for, ingest_files
 
-def create_nodes(all_data):
-    nodes = []
-    for file in all_data:
-        law_dict = file["content"]
-        source_file = file["metadata"]["source"]
-        for key, value in law_dict.items():
-            if not value or len(value.strip()) < 5:
-                continue
-            node_id = f"{source_file}_{key}"
-            parts = key.split(' ', 1)
-            law_name = parts[0] if len(parts) > 0 else "未知法律"
-            article = parts[1] if len(parts) > 1 else "未知条款"
-            node = TextNode(
-                id=node_id,
-                text=value,
-                metadata={
-                    "law_name": law_name,
-                    "article": article,
-                    "full_title": key,
-                    "source_file": source_file,
-                    "content_type": "legal_article"
-                }
-            )
-            nodes.append(node)
-    return nodes
+# embedding 后端：torch 或 onnx-int8，需与检索 API 使用的后端一致
+EMBED_BACKEND = os.getenv("KB_EMBED_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("KB_ONNX_MODEL_DIR", str(project_root / "models" / "minilm-onnx-int8"))
+# 并行 embedding 的进程数，0 或 1 表示在当前进程中串行
+INGEST_WORKERS = int(os.getenv("KB_INGEST_WORKERS", "0"))
+# 向量快照目录（与检索 API 的 KB_SNAPSHOT_DIR 一致），设置后每个集合入库完成即导出最新快照
+SNAPSHOT_DIR = os.getenv("KB_SNAPSHOT_DIR", "")
 
-def save_to_chroma(nodes, collection_name):
+def init_model(embed_spec):
+    # 并行模式下模型在各工作进程中加载
+    if INGEST_WORKERS <= 1:
+        logger.info(f"使用设备: {embed_spec['device']} 加载 Embedding 模型 (后端: {EMBED_BACKEND})...")
+        Settings.embed_model = create_embed_model(**embed_spec)
+    os.makedirs(CHROMADB_PATH, exist_ok=True)
     db = chromadb.PersistentClient(path=CHROMADB_PATH)
-    # 删除已存在集合
-    try:
-        existing_collections = [c.name for c in db.list_collections()]
-        if collection_name in existing_collections:
-            logger.warning(f"删除已存在的集合: {collection_name}")
-            db.delete_collection(name=collection_name)
-    except Exception as e:
-        logger.error(f"删除集合 {collection_name} 失败: {e}")
+    return db
 
-    # 创建集合（严格指定余弦距离）
-    chroma_collection = db.get_or_create_collection(
-        name=collection_name,
-        metadata={"hnsw:space": "cosine"}
-    )
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    storage_context.docstore.add_documents(nodes)
-    index = VectorStoreIndex(
-        nodes,
-        storage_context=storage_context,
-        show_progress=True
-    )
-    logger.info(f"集合 {collection_name} 构建完成，节点数: {len(nodes)}")
+def collection_name_for(file_stem):
+    """由数据文件名得到集合名，无法生成有效名称时返回 None"""
+    file_stem = file_stem.replace(' ', '')
+    if '劳动法' in file_stem:
+        return 'labor_law'
+    if '治安管理处罚法' in file_stem:
+        return 'public_security_law'
+    safe_name = re.sub(r'[^a-zA-Z]', '', file_stem)
+    if not safe_name:
+        return None
+    return safe_name.lower() + "_law"
 
 def main():
-    db = init_model()
-    all_data = load_data(DATA_PATH)
-    if not all_data:
+    rebuild = '--rebuild' in sys.argv[1:]
+    files = sorted(Path(DATA_PATH).glob('*.json'))
+    if not files:
         logger.warning(f"在 {DATA_PATH} 目录下未找到任何 .json 文件。")
         return
-    for file in all_data:
-        file_stem = file["metadata"]["stem"].replace(' ', '')
-        if '劳动法' in file_stem:
-            collection_name = 'labor_law'
-        elif '治安管理处罚法' in file_stem:
-            collection_name = 'public_security_law'
-        else:
-            import re
-            safe_name = re.sub(r'[^a-zA-Z]', '', file_stem)
-            if not safe_name:
-                logger.warning(f"无法为文件 {file_stem} 生成有效的集合名称，已跳过。")
-                continue
-            collection_name = safe_name.lower() + "_law"
-        nodes = create_nodes([file])
-        if not nodes:
-            logger.warning(f"未能从 {file_stem} 创建任何文档节点，跳过。")
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    embed_spec = embed_spec_for(EMBED_BACKEND, MODEL_PATH, INGEST_WORKERS, device=device, onnx_dir=ONNX_MODEL_DIR)
+    db = init_model(embed_spec)
+    for file in files:
+        collection_name = collection_name_for(file.stem)
+        if collection_name is None:
+            logger.warning(f"无法为文件 {file.stem} 生成有效的集合名称，已跳过。")
             continue
-        save_to_chroma(nodes, collection_name)
+        try:
+            ingest_files(
+                db,
+                collection_name,
+                [file],
+                content_type=CONTENT_TYPE_LEGAL_ARTICLE,
+                chroma_path=CHROMADB_PATH,
+                rebuild=rebuild,
+                workers=INGEST_WORKERS,
+                embed_spec=embed_spec,
+                snapshot_dir=SNAPSHOT_DIR or None
+            )
+        except Exception as e:
+            logger.error(f"文件 {file} 入库失败: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,50 @@
+# 抽样剖析的并发测试：两个被抽样的请求同时经工作线程池执行任务时都应正常返回
+# （Python 3.12+ 的 cProfile 基于进程全局的 sys.monitoring，同一时刻只能启用一个剖析器）
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+current_dir = Path(__file__).parent
+sys.path.append(str(current_dir.parent / "api"))
+from request_profiling import RequestTrace, tracing
+from worker_pools import BoundedPool
+
+
+def _overlapping_work(barrier: threading.Barrier) -> int:
+    # 两个任务都进入函数体后才继续，保证剖析区间重叠
+    barrier.wait(timeout=5)
+    return sum(i * i for i in range(10000))
+
+
+async def _sampled_request(pool: BoundedPool, barrier: threading.Barrier):
+    with tracing(RequestTrace(profile=True)) as trace:
+        result = await pool.run(_overlapping_work, barrier, timeout=10)
+    return trace, result
+
+
+def test_concurrent_sampled_requests(tmp_path):
+    pool = BoundedPool("test", max_workers=2, max_queue=0)
+    barrier = threading.Barrier(2)
+
+    async def main():
+        return await asyncio.gather(_sampled_request(pool, barrier), _sampled_request(pool, barrier))
+
+    try:
+        outcomes = asyncio.run(main())
+    finally:
+        pool.shutdown()
+
+    expected = sum(i * i for i in range(10000))
+    assert [result for _, result in outcomes] == [expected, expected]
+    # 同一时刻只有一个任务被剖析，另一个不剖析直接执行
+    paths = [trace.dump(tmp_path, f"request{i}") for i, (trace, _) in enumerate(outcomes)]
+    assert sum(path is not None for path in paths) == 1
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        test_concurrent_sampled_requests(Path(directory))
+    print("ok")